@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from sqlalchemy import exists, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.models import Order, OrderItem, Product
+from app.database.orm_query import orm_rebuild_daily_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+# Разбор старого формата Order.products: "3:2;7:1;" -> [(3, 2), (7, 1)]
+def parse_products(products: str) -> list[tuple[int, int]]:
+    items = []
+    for part in products.split(';'):
+        product_id, _, quantity = part.partition(':')
+        if product_id.strip().isdigit() and quantity.strip().isdigit():
+            items.append((int(product_id), int(quantity)))
+    return items
+
+
+async def _backfill_batch(session: AsyncSession, last_id: int, batch_size: int):
+    query = (
+        select(Order.id, Order.products)
+        .where(Order.id > last_id, ~exists().where(OrderItem.order_id == Order.id))
+        .order_by(Order.id)
+        .limit(batch_size)
+    )
+    orders = (await session.execute(query)).all()
+    if not orders:
+        return None
+
+    parsed = {order.id: parse_products(order.products) for order in orders}
+    product_ids = {product_id for items in parsed.values() for product_id, _ in items}
+
+    # Цен на момент старых заказов нет - берем текущую. Удаленный товар пишем без ссылки и с нулевой ценой
+    prices = {}
+    if product_ids:
+        result = await session.execute(select(Product.id, Product.price).where(Product.id.in_(product_ids)))
+        prices = dict(result.all())
+
+    rows = [
+        {
+            "order_id": order_id,
+            "product_id": product_id if product_id in prices else None,
+            "quantity": quantity,
+            "price": prices.get(product_id, 0),
+        }
+        for order_id, items in parsed.items()
+        for product_id, quantity in items
+    ]
+    if rows:
+        await session.execute(insert(OrderItem), rows)
+    await session.commit()
+    return orders[-1].id, len(orders), len(rows)
+
+
+# Переносит старые заказы в order_item пачками по batch_size, двигаясь по Order.id (keyset).
+# В памяти одновременно только одна пачка, каждая пачка - отдельная транзакция,
+# поэтому прерванный перенос можно просто запустить заново
+async def backfill_order_items(session_pool: async_sessionmaker, batch_size: int = 1000):
+    last_id = 0
+    orders_count = 0
+    items_count = 0
+    while True:
+        async with session_pool() as session:
+            batch = await _backfill_batch(session, last_id, batch_size)
+        if batch is None:
+            break
+        last_id, orders, items = batch
+        orders_count += orders
+        items_count += items
+        logger.info("Backfilled %s orders (%s items), last order id %s", orders_count, items_count, last_id)
+    return orders_count, items_count
+
+
+async def main():
+    from app.database.engine import session_maker
+
+    orders, items = await backfill_order_items(session_maker)
+    print(f"Перенесено заказов: {orders}, позиций: {items}")
+
+    # Сводки для статистики пересчитываем уже по перенесенным позициям
+    async with session_maker() as session:
+        await orm_rebuild_daily_stats(session)
+        await session.commit()
+    print("Сводки статистики пересчитаны")
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
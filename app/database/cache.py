@@ -0,0 +1,265 @@
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database.models import Banner, Category, Product
+
+
+logger = logging.getLogger(__name__)
+
+
+########################### Кэш баннеров ############################################
+
+# Баннеров всего несколько штук и меняются они только из админки,
+# поэтому грузим всю таблицу одним запросом и дальше отдаем из памяти.
+class BannerCache:
+    def __init__(self):
+        self._banners: dict[str, Banner] | None = None
+        self._lock = asyncio.Lock()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def _load(self, session: AsyncSession) -> dict[str, Banner]:
+        async with self._lock:
+            if self._banners is not None:
+                return self._banners
+
+            version = self._version
+            result = await session.execute(select(Banner))
+            banners = result.scalars().all()
+            # Отвязываем объекты от сессии хендлера, иначе rollback/close их "протухнет"
+            for banner in banners:
+                session.expunge(banner)
+            loaded = {banner.name: banner for banner in banners}
+
+            # Пока грузили, баннер могли изменить - такой снимок не сохраняем
+            if version == self._version:
+                self._banners = loaded
+            return loaded
+
+    async def _get_all(self, session: AsyncSession) -> dict[str, Banner]:
+        banners = self._banners
+        if banners is not None:
+            self.hits += 1
+            return banners
+        self.misses += 1
+        return await self._load(session)
+
+    async def get(self, session: AsyncSession, name: str) -> Banner | None:
+        banners = await self._get_all(session)
+        return banners.get(name)
+
+    async def all(self, session: AsyncSession) -> list[Banner]:
+        banners = await self._get_all(session)
+        return list(banners.values())
+
+    def invalidate(self):
+        self._version += 1
+        self._banners = None
+        logger.info("Banner cache invalidated (hits=%s, misses=%s)", self.hits, self.misses)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._banners) if self._banners is not None else 0,
+            "version": self._version,
+        }
+
+
+banner_cache = BannerCache()
+
+#############################################################################
+
+
+
+########################### Снимок каталога ############################################
+
+# Категории, товары по категориям и уже открытые страницы товаров живут в памяти под счетчиком версии.
+# Любое изменение ассортимента поднимает версию и сбрасывает снимок,
+# поэтому следующий читатель сразу видит свежие данные.
+class CatalogCache:
+    def __init__(self):
+        self._version = 0
+        self._categories: tuple[Category, ...] | None = None
+        self._products: dict[int, tuple[Product, ...]] = {}
+        self._product_pages: dict[tuple[int, int, int], tuple[tuple[Product, ...], int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @staticmethod
+    def _detach(session: AsyncSession, objects) -> tuple:
+        for obj in objects:
+            session.expunge(obj)
+        return tuple(objects)
+
+    async def get_categories(self, session: AsyncSession) -> tuple[Category, ...]:
+        categories = self._categories
+        if categories is not None:
+            self.hits += 1
+            return categories
+
+        self.misses += 1
+        version = self._version
+        result = await session.execute(select(Category).order_by(Category.id))
+        categories = self._detach(session, result.scalars().all())
+        if version == self._version:
+            self._categories = categories
+        return categories
+
+    async def get_products(self, session: AsyncSession, category_id: int) -> tuple[Product, ...]:
+        products = self._products.get(category_id)
+        if products is not None:
+            self.hits += 1
+            return products
+
+        self.misses += 1
+        version = self._version
+        query = select(Product).where(Product.category_id == category_id).order_by(Product.id)
+        result = await session.execute(query)
+        products = self._detach(session, result.scalars().all())
+        if version == self._version:
+            self._products[category_id] = products
+        return products
+
+    # Одна страница товаров категории и общее количество товаров в ней.
+    # В БД уходит только LIMIT/OFFSET выборка, количество считается оконной функцией в том же запросе
+    async def get_products_page(
+        self, session: AsyncSession, category_id: int, page: int, per_page: int = 1
+    ) -> tuple[tuple[Product, ...], int]:
+        key = (category_id, page, per_page)
+        cached = self._product_pages.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        version = self._version
+        query = (
+            select(Product, func.count().over())
+            .where(Product.category_id == category_id)
+            .order_by(Product.id)
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+        )
+        rows = (await session.execute(query)).all()
+        if rows:
+            total = rows[0][1]
+        else:
+            # Страница за пределами категории - отдельно узнаем сколько товаров всего
+            query = select(func.count()).select_from(Product).where(Product.category_id == category_id)
+            total = await session.scalar(query)
+
+        cached = (self._detach(session, [row[0] for row in rows]), total)
+        if version == self._version:
+            self._product_pages[key] = cached
+        return cached
+
+    def invalidate(self):
+        # Версия и снимок меняются в одном синхронном шаге - между ними нет await
+        self._version += 1
+        self._categories = None
+        self._products = {}
+        self._product_pages = {}
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "categories": len(self._categories) if self._categories is not None else 0,
+            "product_lists": len(self._products),
+            "product_pages": len(self._product_pages),
+            "version": self._version,
+        }
+
+
+catalog_cache = CatalogCache()
+
+#############################################################################
+
+
+
+########################### Сброс кэшей после коммита ############################################
+
+# ORM-функции только делают flush, коммитит middleware в конце апдейта.
+# Поэтому кэши сбрасываются не сразу, а после успешного коммита транзакции,
+# иначе параллельный читатель успел бы закэшировать еще незакоммиченное состояние под новой версией
+def invalidate_on_commit(session: AsyncSession, cache: BannerCache | CatalogCache):
+    session.info.setdefault('invalidate_caches', set()).add(cache)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_caches(session: Session):
+    caches = session.info.pop('invalidate_caches', ())
+    for cache in caches:
+        cache.invalidate()
+    if caches:
+        shared_invalidation.publish()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session: Session):
+    session.info.pop('invalidate_caches', None)
+
+#############################################################################
+
+
+
+########################### Кэши в нескольких процессах ############################################
+
+# В режиме воркеров (app/utils/workers.py) у каждого процесса свои кэши.
+# Процесс, сбросивший кэш после коммита, поднимает общий счетчик поколений,
+# а остальные сверяются с ним перед каждым апдейтом и при расхождении сбрасывают свои кэши.
+# Другие состояния процесса (реестр админов) подписываются на сброс через subscribe
+class SharedInvalidation:
+    def __init__(self):
+        self._counter = None
+        self._seen = 0
+        self._listeners: list[Callable[[], None]] = []
+
+    def attach(self, counter):
+        self._counter = counter
+        self._seen = counter.value
+
+    def subscribe(self, listener: Callable[[], None]):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _invalidate_all(self):
+        banner_cache.invalidate()
+        catalog_cache.invalidate()
+        for listener in self._listeners:
+            listener()
+
+    def publish(self):
+        if self._counter is None:
+            return
+        with self._counter.get_lock():
+            # Пропустили чужой сброс - сбрасываем все, а не только свой кэш
+            stale = self._counter.value != self._seen
+            self._counter.value += 1
+            self._seen = self._counter.value
+        if stale:
+            self._invalidate_all()
+
+    def sync(self):
+        if self._counter is None:
+            return
+        generation = self._counter.value
+        if generation != self._seen:
+            self._seen = generation
+            self._invalidate_all()
+
+
+shared_invalidation = SharedInvalidation()
+
+#############################################################################
@@ -1,24 +1,69 @@
+import asyncio
+import logging
 import os
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
+from app.database.instrumentation import sql_instrumentation
 from app.database.models import Base
+from app.database.migrations import LATEST_VERSION, apply_migrations, get_schema_version
 
 from app.common.texts_for_db import categories, description_for_info_pages
-from app.database.orm_query import orm_add_banner_description, orm_create_category, orm_drop_cart, orm_drop_user
+from app.database.orm_query import (
+    orm_add_banner_description,
+    orm_create_category,
+    orm_drop_cart,
+    orm_drop_user,
+    orm_get_categories,
+    orm_get_info_pages,
+)
 
 
-engine = create_async_engine(os.getenv('DATABASE_URL'), echo=True)
+logger = logging.getLogger(__name__)
+
+engine = create_async_engine(os.getenv('DATABASE_URL'))
+
+# Вместо echo=True: метрики запросов и лог медленных (SQL_SLOW_QUERY_MS).
+# Поштучный лог запросов - SQL_LOG=1 или /sql_log в админке
+sql_instrumentation.slow_query_ms = float(os.getenv('SQL_SLOW_QUERY_MS', 100))
+sql_instrumentation.log_queries = os.getenv('SQL_LOG') == '1'
+sql_instrumentation.attach(engine)
 session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 
-async def create_db():
-        
+# Схема уже последней версии - значит, ее создал и наполнил один из прошлых запусков:
+# DDL (create_all с рефлексией всех таблиц) и проверки наполнения пропускаются
+async def create_db() -> bool:
+    version = await get_schema_version(engine)
+    if version is not None and version >= LATEST_VERSION:
+        logger.info("Schema is up to date (version %s)", version)
+        return False
+
+    # Наполнение идет в транзакции миграций: версия схемы фиксируется только вместе с ним,
+    # и упавший между ними запуск не оставит базу "актуальной", но пустой
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        
+        await conn.run_sync(apply_migrations)
+        async with AsyncSession(bind=conn) as session:
+            await orm_create_category(session, categories)
+            await orm_add_banner_description(session, description_for_info_pages)
+            await session.flush()
+    return True
+
+
+# Открывает соединения пула заранее, чтобы первые апдейты не ждали подключения к БД
+async def warm_up_pool(connections: int = 5):
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+
+# Баннеры и категории читаются почти каждым апдейтом меню - загружаем их в кэш до первых апдейтов
+async def prime_caches():
     async with session_maker() as session:
-        await orm_create_category(session, categories)
-        await orm_add_banner_description(session, description_for_info_pages)
+        await orm_get_info_pages(session)
+        await orm_get_categories(session)
         
         
 async def drop_db():
@@ -0,0 +1,128 @@
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database.orm_query import orm_get_fsm_state, orm_set_fsm_state
+
+
+class _Record:
+    __slots__ = ("state", "data", "loaded", "state_changed", "data_changed")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, loaded: bool = False):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.loaded = loaded
+        self.state_changed = False
+        self.data_changed = False
+
+
+# Буфер текущего апдейта: ключ FSM -> прочитанное/измененное состояние
+_update_buffer: ContextVar[Optional[Dict[str, _Record]]] = ContextVar("fsm_update_buffer", default=None)
+
+
+# Хранилище FSM в таблице fsm_state.
+# Внутри апдейта (см. BufferedFSMContextMiddleware) состояние читается из БД один раз, а все
+# set_state/update_data копятся в памяти и пишутся одним upsert'ом на ключ в конце апдейта.
+# Вне апдейта хранилище работает напрямую с БД
+class SQLAlchemyStorage(BaseStorage):
+    def __init__(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        self.reads = 0
+        self.writes = 0
+
+    @staticmethod
+    def build_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def begin(self) -> Token:
+        return _update_buffer.set({})
+
+    def end(self, token: Token):
+        _update_buffer.reset(token)
+
+    async def _load(self, key: str) -> _Record:
+        buffer = _update_buffer.get()
+        record = buffer.get(key) if buffer is not None else None
+        if record is not None and record.loaded:
+            return record
+
+        async with self.session_pool() as session:
+            row = await orm_get_fsm_state(session, key)
+        self.reads += 1
+        loaded = _Record(row.state, dict(row.data or {}), loaded=True) if row else _Record(loaded=True)
+
+        # Изменения, сделанные в этом апдейте до первого чтения, важнее прочитанного
+        if record is not None:
+            if record.state_changed:
+                loaded.state, loaded.state_changed = record.state, True
+            if record.data_changed:
+                loaded.data, loaded.data_changed = record.data, True
+
+        if buffer is not None:
+            buffer[key] = loaded
+        return loaded
+
+    async def _write(self, key: str, **values):
+        buffer = _update_buffer.get()
+        if buffer is None:
+            async with self.session_pool() as session:
+                await orm_set_fsm_state(session, key, **values)
+                await session.commit()
+            self.writes += 1
+            return
+
+        record = buffer.setdefault(key, _Record())
+        if "state" in values:
+            record.state, record.state_changed = values["state"], True
+        if "data" in values:
+            record.data, record.data_changed = values["data"], True
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(self.build_key(key), state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(self.build_key(key))
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(self.build_key(key), data=dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(self.build_key(key))
+        return dict(record.data)
+
+    # Все изменения апдейта - одна транзакция и по одному upsert'у на ключ
+    async def flush(self):
+        buffer = _update_buffer.get()
+        if not buffer:
+            return
+
+        dirty = {key: record for key, record in buffer.items() if record.state_changed or record.data_changed}
+        if not dirty:
+            return
+
+        async with self.session_pool() as session:
+            for key, record in dirty.items():
+                values = {}
+                if record.state_changed:
+                    values["state"] = record.state
+                if record.data_changed:
+                    values["data"] = record.data
+                await orm_set_fsm_state(session, key, **values)
+            await session.commit()
+
+        self.writes += len(dirty)
+        for record in dirty.values():
+            record.state_changed = record.data_changed = False
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+        }
@@ -0,0 +1,167 @@
+import bisect
+import logging
+import re
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+logger = logging.getLogger("app.sql")
+slow_logger = logging.getLogger("app.sql.slow")
+
+
+# Границы корзин гистограмм: время запроса в мс и число запросов на апдейт
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50)
+
+_NUMBERED_PLACEHOLDER = re.compile(r"\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_VALUES_LIST = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r"\s+")
+
+
+# Одинаковые запросы с разным числом параметров (IN (...), многострочный VALUES)
+# и литералами (LIMIT 10 OFFSET 20) сводятся к одному ключу
+@lru_cache(maxsize=2048)
+def normalize_sql(statement: str) -> str:
+    sql = _SPACES.sub(" ", statement).strip()
+    sql = _NUMBERED_PLACEHOLDER.sub("?", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?)", sql)
+    sql = _VALUES_LIST.sub(r"\1", sql)
+    return sql
+
+
+class Histogram:
+    __slots__ = ("bounds", "buckets", "count", "total", "max")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # Оценка перцентиля по верхней границе корзины
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket in zip(self.bounds, self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class UpdateQueries:
+    __slots__ = ("count", "time")
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+
+_current_update: ContextVar[UpdateQueries | None] = ContextVar("sql_update_queries", default=None)
+
+
+# Инструментирование запросов через события движка вместо echo=True:
+# гистограммы времени по нормализованному SQL, число запросов и время БД на апдейт,
+# лог медленных запросов. Поштучный лог запросов выключен и включается на лету (log_queries)
+class SQLInstrumentation:
+    def __init__(self, slow_query_ms: float = 100, log_queries: bool = False):
+        self.slow_query_ms = slow_query_ms
+        self.log_queries = log_queries
+        self.statements: dict[str, Histogram] = {}
+        self.queries_per_update = Histogram(QUERY_COUNT_BUCKETS)
+        self.slow_queries = 0
+
+    def attach(self, engine: AsyncEngine):
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_started = perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context._query_started
+        elapsed_ms = elapsed * 1000
+        key = normalize_sql(statement)
+
+        histogram = self.statements.get(key)
+        if histogram is None:
+            histogram = self.statements[key] = Histogram(LATENCY_BUCKETS_MS)
+        histogram.observe(elapsed_ms)
+
+        current = _current_update.get()
+        if current is not None:
+            current.count += 1
+            current.time += elapsed
+
+        if elapsed_ms >= self.slow_query_ms:
+            self.slow_queries += 1
+            slow_logger.warning("Slow query (%.1f ms): %s", elapsed_ms, key)
+        if self.log_queries:
+            logger.info("%.2f ms: %s", elapsed_ms, key)
+
+    # Счетчик запросов текущего апдейта (см. SQLStatsMiddleware)
+    def begin_update(self) -> Token:
+        return _current_update.set(UpdateQueries())
+
+    def end_update(self, token: Token) -> UpdateQueries:
+        current = _current_update.get()
+        _current_update.reset(token)
+        self.queries_per_update.observe(current.count)
+        return current
+
+    @staticmethod
+    def current_update() -> UpdateQueries | None:
+        return _current_update.get()
+
+    def top_statements(self, limit: int = 10, by: str = "total") -> list[tuple[str, dict]]:
+        stats = [(key, histogram.as_dict()) for key, histogram in self.statements.items()]
+        stats.sort(key=lambda item: item[1][by], reverse=True)
+        return stats[:limit]
+
+    def reset(self):
+        self.statements = {}
+        self.queries_per_update = Histogram(QUERY_COUNT_BUCKETS)
+        self.slow_queries = 0
+
+    def stats(self) -> dict:
+        return {
+            "statements": len(self.statements),
+            "queries": sum(histogram.count for histogram in self.statements.values()),
+            "slow_queries": self.slow_queries,
+            "queries_per_update": self.queries_per_update.as_dict(),
+            "log_queries": self.log_queries,
+        }
+
+
+sql_instrumentation = SQLInstrumentation()
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Connection, delete, func, inspect, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateColumn
+
+from app.database.models import (
+    Admin,
+    Base,
+    Campaign,
+    Cart,
+    DailyProductStats,
+    DailyStats,
+    FSMState,
+    Order,
+    OrderItem,
+    Product,
+    SchemaVersion,
+    User,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Миграция схемы: upgrade получает синхронное соединение внутри общей транзакции.
+# Новые таблицы создает и create_all, но любое изменение схемы (в том числе новая таблица)
+# получает свою миграцию - номер последней из них и есть версия схемы.
+# Миграции должны быть идемпотентными - таблицы и индексы создаются с checkfirst
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_tables(*models):
+    def upgrade(conn: Connection):
+        for model in models:
+            model.__table__.create(conn, checkfirst=True)
+    return upgrade
+
+
+def _create_indexes(*columns):
+    def upgrade(conn: Connection):
+        for column in columns:
+            for index in column.table.indexes:
+                if [c.name for c in index.columns] == [column.name]:
+                    index.create(conn, checkfirst=True)
+    return upgrade
+
+
+def _add_columns(*columns):
+    def upgrade(conn: Connection):
+        for column in columns:
+            table = column.table
+            existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+            if column.name not in existing:
+                definition = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {definition}")
+    return upgrade
+
+
+def _run_all(*upgrades):
+    def upgrade(conn: Connection):
+        for step in upgrades:
+            step(conn)
+    return upgrade
+
+
+# До уникального индекса в корзине могли появиться дубли (user_id, product_id):
+# складываем их количество в самую раннюю строку, остальные удаляем
+def _add_cart_unique_index(conn: Connection):
+    cart = Cart.__table__
+    duplicate = cart.alias('duplicate')
+    same_position = (duplicate.c.user_id == cart.c.user_id) & (duplicate.c.product_id == cart.c.product_id)
+    first_id = select(func.min(duplicate.c.id)).where(same_position).scalar_subquery()
+    quantity = select(func.sum(duplicate.c.quantity)).where(same_position).scalar_subquery()
+
+    conn.execute(update(cart).where(cart.c.id == first_id).values(quantity=quantity))
+    conn.execute(delete(cart).where(cart.c.id != first_id))
+
+    for index in cart.indexes:
+        if index.name == 'uq_cart_user_product':
+            index.create(conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Индексы на cart.product_id, order.user_id, product.category_id, order_item",
+        _create_indexes(Cart.product_id, Order.user_id, Product.category_id, OrderItem.order_id, OrderItem.product_id),
+    ),
+    Migration(2, "Уникальный индекс корзины (user_id, product_id)", _add_cart_unique_index),
+    Migration(3, "Таблица fsm_state для хранилища FSM", _create_tables(FSMState)),
+    Migration(4, "Таблица admin для реестра администраторов", _create_tables(Admin)),
+    Migration(
+        5,
+        "Рассылки: таблица campaign и user.is_blocked",
+        _run_all(_add_columns(User.is_blocked), _create_tables(Campaign)),
+    ),
+    Migration(6, "Аренда рассылок: campaign.owner и campaign.lease_until", _add_columns(Campaign.owner, Campaign.lease_until)),
+    # Таблицы, появившиеся до введения миграций (их создавал только create_all)
+    Migration(
+        7,
+        "Таблицы order_item, daily_stats и daily_product_stats",
+        _create_tables(OrderItem, DailyStats, DailyProductStats),
+    ),
+    Migration(8, "Индекс на daily_product_stats.product_id", _create_indexes(DailyProductStats.product_id)),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def apply_migrations(conn: Connection) -> list[int]:
+    # Пустая база целиком создается по моделям, миграции для нее только отмечаются примененными
+    fresh = not inspect(conn).has_table(Cart.__tablename__)
+    Base.metadata.create_all(conn)
+
+    applied_versions = set(conn.scalars(select(SchemaVersion.version)))
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version in applied_versions:
+            continue
+        if not fresh:
+            logger.info("Applying migration %s: %s", migration.version, migration.description)
+            migration.upgrade(conn)
+        conn.execute(insert(SchemaVersion).values(version=migration.version, description=migration.description))
+        applied.append(migration.version)
+    return applied
+
+
+# Версия схемы одним запросом, без рефлексии таблиц. None - схемы еще нет
+async def get_schema_version(engine: AsyncEngine) -> int | None:
+    async with engine.connect() as conn:
+        try:
+            return await conn.scalar(select(func.max(SchemaVersion.version)))
+        except DBAPIError:
+            return None
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    async with engine.begin() as conn:
+        return await conn.run_sync(apply_migrations)
+
+
+async def main():
+    from app.database.engine import engine
+
+    applied = await migrate(engine)
+    print(f"Применены миграции: {applied}" if applied else "Схема актуальна")
+    print(f"Версия схемы: {LATEST_VERSION}")
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import ARRAY, JSON, BigInteger, DateTime, Float, ForeignKey, Numeric, String, Text, func
+from sqlalchemy import ARRAY, JSON, BigInteger, Date, DateTime, Float, ForeignKey, Index, Numeric, String, Text, false, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -31,7 +31,7 @@ class Product(Base):
     description: Mapped[str] = mapped_column(Text)
     price: Mapped[float] = mapped_column(nullable=False)
     image: Mapped[str] = mapped_column(String(150))
-    category_id: Mapped[int] = mapped_column(ForeignKey('category.id', ondelete='CASCADE'), nullable=False)
+    category_id: Mapped[int] = mapped_column(ForeignKey('category.id', ondelete='CASCADE'), nullable=False, index=True)
 
     category: Mapped['Category'] = relationship(backref='product')
 
@@ -44,14 +44,19 @@ class User(Base):
     first_name: Mapped[str] = mapped_column(String(150), nullable=True)
     last_name: Mapped[str]  = mapped_column(String(150), nullable=True)
     phone: Mapped[str]  = mapped_column(String(13), nullable=True)
+    # Пользователь заблокировал бота - рассылки его пропускают
+    is_blocked: Mapped[bool] = mapped_column(default=False, server_default=false(), nullable=False)
 
 
 class Cart(Base):
     __tablename__ = 'cart'
+    # Уникальный индекс (а не constraint), чтобы у него было одинаковое имя в PostgreSQL и SQLite.
+    # Он же обслуживает все выборки корзины по user_id
+    __table_args__ = (Index('uq_cart_user_product', 'user_id', 'product_id', unique=True),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
     quantity: Mapped[int]
 
     user: Mapped['User'] = relationship(backref='cart')
@@ -62,10 +67,93 @@ class Order(Base):
     __tablename__ = 'order'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id'), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id'), nullable=False, index=True)
     products: Mapped[str] = mapped_column(Text, nullable=False)
     phone: Mapped[str] = mapped_column(String(13), nullable=False)
     address: Mapped[str] = mapped_column(String(150), nullable=True)
     total_price: Mapped[float] = mapped_column(nullable=False)
 
-    user: Mapped['User'] = relationship(backref='order')
\ No newline at end of file
+    user: Mapped['User'] = relationship(backref='order')
+
+
+class OrderItem(Base):
+    __tablename__ = 'order_item'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey('order.id', ondelete='CASCADE'), nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='SET NULL'), nullable=True, index=True)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+    # Цена товара на момент заказа
+    price: Mapped[float] = mapped_column(nullable=False)
+
+    order: Mapped['Order'] = relationship(backref='items')
+    product: Mapped['Product'] = relationship(backref='order_items')
+
+
+# Дневные сводки для экрана статистики. Обновляются инкрементально при оформлении заказа
+# и регистрации пользователя, средний чек считается как revenue / orders
+class DailyStats(Base):
+    __tablename__ = 'daily_stats'
+
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    orders: Mapped[int] = mapped_column(default=0, nullable=False)
+    revenue: Mapped[float] = mapped_column(default=0, nullable=False)
+    new_users: Mapped[int] = mapped_column(default=0, nullable=False)
+
+
+class DailyProductStats(Base):
+    __tablename__ = 'daily_product_stats'
+
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    # Отдельный индекс для каскадного удаления товара: первичный ключ начинается с day
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), primary_key=True, index=True)
+    quantity: Mapped[int] = mapped_column(default=0, nullable=False)
+    revenue: Mapped[float] = mapped_column(default=0, nullable=False)
+
+
+# Состояния FSM (aiogram) - переживают перезапуск и общие для всех процессов бота
+class FSMState(Base):
+    __tablename__ = 'fsm_state'
+
+    key: Mapped[str] = mapped_column(String(150), primary_key=True)
+    state: Mapped[str] = mapped_column(String(150), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+
+# Администраторы групп бота (заполняет app/utils/admins.py через getChatAdministrators).
+# updated - время последнего обновления списка админов группы
+class Admin(Base):
+    __tablename__ = 'admin'
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)
+
+
+# Рассылка админа. last_user_id - User.id последнего обработанного пользователя,
+# с него рассылка продолжается после перезапуска. status: running, done, cancelled, failed
+class Campaign(Base):
+    __tablename__ = 'campaign'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text, nullable=True)
+    image: Mapped[str] = mapped_column(String(150), nullable=True)
+    status: Mapped[str] = mapped_column(String(20), default='running', nullable=False)
+    admin_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    report_message_id: Mapped[int] = mapped_column(nullable=True)
+    last_user_id: Mapped[int] = mapped_column(default=0, nullable=False)
+    total: Mapped[int] = mapped_column(default=0, nullable=False)
+    sent: Mapped[int] = mapped_column(default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(default=0, nullable=False)
+    blocked: Mapped[int] = mapped_column(default=0, nullable=False)
+    # Аренда рассылки: ее ведет только процесс owner, пока не истек lease_until (UTC)
+    owner: Mapped[str] = mapped_column(String(100), nullable=True)
+    lease_until: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+
+
+# Примененные миграции схемы (app/database/migrations.py)
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    description: Mapped[str] = mapped_column(String(150), nullable=False)
@@ -1,9 +1,33 @@
-from sqlalchemy import delete, select, update
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
-
-from app.database.models import Banner, Cart, Category, Order, Product, User
+from datetime import date, datetime, timedelta, timezone
 
+from sqlalchemy import case, delete, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app.database.cache import banner_cache, catalog_cache, invalidate_on_commit
+from app.database.models import (
+    Admin,
+    Banner,
+    Campaign,
+    Cart,
+    Category,
+    DailyProductStats,
+    DailyStats,
+    FSMState,
+    Order,
+    OrderItem,
+    Product,
+    User,
+)
+
+
+# INSERT ... ON CONFLICT есть и в PostgreSQL, и в SQLite, но конструкторы у диалектов свои
+def _insert(session: AsyncSession, model):
+    if session.bind.dialect.name == 'sqlite':
+        return sqlite_insert(model)
+    return postgresql_insert(model)
 
 
 ########################### АДМИНКА: добавить/удалить/изменить товар ############################################
@@ -17,13 +41,16 @@ async def orm_add_product(session: AsyncSession, data: dict):
         category_id=data["category"]
     )
     session.add(obj)
-    await session.commit()
+    await session.flush()
+    invalidate_on_commit(session, catalog_cache)
     
     
 async def orm_get_products(session: AsyncSession, category_id: int):
-    query = select(Product).where(Product.category_id == category_id)
-    result = await session.execute(query)
-    return result.scalars().all()
+    return await catalog_cache.get_products(session, category_id)
+
+
+async def orm_get_products_page(session: AsyncSession, category_id: int, page: int = 1, per_page: int = 1):
+    return await catalog_cache.get_products_page(session, category_id, page, per_page)
 
 
 async def orm_get_product(session: AsyncSession, product_id: int):
@@ -41,13 +68,13 @@ async def orm_update_product(session: AsyncSession, product_id: int, data: dict)
         category_id=data["category"]
     )
     await session.execute(query)
-    await session.commit()
+    invalidate_on_commit(session, catalog_cache)
     
     
 async def orm_delete_product(session: AsyncSession, product_id: int):
     query = delete(Product).where(Product.id == product_id)
     await session.execute(query)
-    await session.commit()
+    invalidate_on_commit(session, catalog_cache)
     
 #############################################################################
 
@@ -56,19 +83,17 @@ async def orm_delete_product(session: AsyncSession, product_id: int):
 ########################### Категории ############################################
 
 async def orm_get_categories(session: AsyncSession):
-    query = select(Category)
-    result = await session.execute(query)
-    return result.scalars().all()
+    return await catalog_cache.get_categories(session)
 
 
 async def orm_create_category(session: AsyncSession, categories: list):
-    query = select(Category)
-    result = await session.execute(query)
-    if result.first():
+    query = select(Category.id).limit(1)
+    if await session.scalar(query) is not None:
         return
     else:
         session.add_all([Category(name=name) for name in categories])
-        await session.commit()
+        await session.flush()
+        invalidate_on_commit(session, catalog_cache)
         
         
 #############################################################################
@@ -78,32 +103,27 @@ async def orm_create_category(session: AsyncSession, categories: list):
 ########################### Работа с баннерами ############################################
 
 async def orm_add_banner_description(session: AsyncSession, data: dict):
-    query = select(Banner)
-    result = await session.execute(query)
-    
-    if result.first():
+    query = select(Banner.id).limit(1)
+    if await session.scalar(query) is not None:
         return
     else:
         session.add_all([Banner(name=name, description=description) for name, description in data.items()])
-        await session.commit()
+        await session.flush()
+        invalidate_on_commit(session, banner_cache)
 
 
 async def orm_change_banner_image(session: AsyncSession, name: str, image: str):
     query = update(Banner).where(Banner.name == name).values(image=image)
     await session.execute(query)
-    await session.commit()
+    invalidate_on_commit(session, banner_cache)
     
     
 async def orm_get_banner(session: AsyncSession, page: str):
-    query = select(Banner).where(Banner.name == page)
-    result = await session.execute(query)
-    return result.scalar()
+    return await banner_cache.get(session, page)
 
 
 async def orm_get_info_pages(session: AsyncSession):
-    query = select(Banner)
-    result = await session.execute(query)
-    return result.scalars().all()
+    return await banner_cache.all(session)
     
 
 ########################### Пользователи ############################################
@@ -116,20 +136,23 @@ async def orm_add_user(
     phone: str | None = None
 ):
     query = select(User).where(User.user_id == user_id)
-    result = await session.execute(query)
+    user = (await session.execute(query)).scalar()
     
-    if result.first() is None:
+    if user is None:
         session.add(User(user_id=user_id, 
                          first_name=first_name, 
                          last_name=last_name, 
                          phone=phone))
-        await session.commit()
+        await session.flush()
+        await orm_add_daily_stats(session, new_users=1)
+    elif user.is_blocked:
+        # Пользователь снова написал боту - значит, разблокировал его
+        user.is_blocked = False
         
         
 async def orm_drop_user(session: AsyncSession):
     query = delete(User)
     await session.execute(query)
-    await session.commit()
     
 
 async def orm_get_users(session: AsyncSession):
@@ -139,18 +162,18 @@ async def orm_get_users(session: AsyncSession):
         
 ######################## Работа с корзинами #######################################
 
+# Возвращает новое количество товара в корзине
 async def orm_add_to_cart(session: AsyncSession, user_id: int, product_id: int):
-    query = select(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id).options(joinedload(Cart.product))
-    cart = await session.execute(query)
-    cart = cart.scalar()
-    if cart:
-        cart.quantity += 1
-        await session.commit()
-        return cart
-    else:
-        session.add(Cart(user_id=user_id, product_id=product_id, quantity=1))
-        await session.commit()
-
+    query = (
+        _insert(session, Cart)
+        .values(user_id=user_id, product_id=product_id, quantity=1)
+        .on_conflict_do_update(
+            index_elements=[Cart.user_id, Cart.product_id],
+            set_={"quantity": Cart.quantity + 1, "updated": func.now()},
+        )
+        .returning(Cart.quantity)
+    )
+    return await session.scalar(query)
 
 
 async def orm_get_user_carts(session: AsyncSession, user_id):
@@ -159,48 +182,423 @@ async def orm_get_user_carts(session: AsyncSession, user_id):
     return result.scalars().all()
 
 
+# Состав корзины для оформления заказа: одна выборка с названием и ценой каждого товара
+async def orm_get_cart_summary(session: AsyncSession, user_id: int):
+    query = (
+        select(Product.id.label("product_id"), Product.name, Product.price, Cart.quantity)
+        .select_from(Cart)
+        .join(Cart.product)
+        .where(Cart.user_id == user_id)
+        .order_by(Cart.id)
+    )
+    result = await session.execute(query)
+    return result.all()
+
+
+# Страница корзины одним запросом: строки страницы, количество позиций и сумма всей корзины.
+# Оконные функции считаются по всей корзине пользователя до применения LIMIT/OFFSET
+async def orm_get_user_cart_page(session: AsyncSession, user_id: int, page: int = 1, per_page: int = 1):
+    cart_total = func.sum(Cart.quantity * Product.price)
+    query = (
+        select(Cart, func.count().over(), cart_total.over())
+        .join(Cart.product)
+        .options(contains_eager(Cart.product))
+        .where(Cart.user_id == user_id)
+        .order_by(Cart.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    )
+    rows = (await session.execute(query)).all()
+    if rows:
+        return [row[0] for row in rows], rows[0][1], rows[0][2]
+
+    query = select(func.count(), cart_total).select_from(Cart).join(Cart.product).where(Cart.user_id == user_id)
+    carts_count, total_price = (await session.execute(query)).one()
+    return [], carts_count, total_price or 0
+
+
 async def orm_delete_from_cart(session: AsyncSession, user_id: int, product_id: int):
     query = delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id)
     await session.execute(query)
-    await session.commit()
 
 
+# Возвращает новое количество товара в корзине, 0 - позиция удалена (или ее уже не было)
 async def orm_reduce_product_in_cart(session: AsyncSession, user_id: int, product_id: int):
-    query = select(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id).options(joinedload(Cart.product))
-    cart = await session.execute(query)
-    cart = cart.scalar()
+    query = (
+        update(Cart)
+        .where(Cart.user_id == user_id, Cart.product_id == product_id, Cart.quantity > 1)
+        .values(quantity=Cart.quantity - 1)
+        .returning(Cart.quantity)
+    )
+    quantity = await session.scalar(query)
 
-    if not cart:
-        return
-    if cart.quantity > 1:
-        cart.quantity -= 1
-        await session.commit()
-        return True
-    else:
-        await orm_delete_from_cart(session, user_id, product_id)
-        await session.commit()
-        return False
+    if quantity is None:
+        query = delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id, Cart.quantity <= 1)
+        await session.execute(query)
+        quantity = 0
+
+    return quantity
     
+
 async def orm_drop_cart(session: AsyncSession):
     query = delete(Cart)
     await session.execute(query)
-    await session.commit()
     
     
     
 ###################################### РАБОТА С ЗАКАЗАМИ #################################
 
+# Позиции заказа (data["items"]: product_id, quantity, price) вставляются одним bulk INSERT
 async def orm_add_order(session: AsyncSession, data: dict):
-    print(data)
-    session.add(Order(user_id=data["user_id"], 
-                      products=data["products"], 
-                      phone=data["phone"], 
-                      address=data["address"], 
-                      total_price=data["total_price"]))
-    await session.commit()
+    order = Order(user_id=data["user_id"], 
+                  products=data["products"], 
+                  phone=data["phone"], 
+                  address=data["address"], 
+                  total_price=data["total_price"])
+    session.add(order)
+    await session.flush()
+
+    items = data.get("items")
+    if items:
+        await session.execute(insert(OrderItem), [{"order_id": order.id, **item} for item in items])
+
+    await orm_add_daily_stats(session, orders=1, revenue=data["total_price"])
+    await orm_add_daily_product_stats(session, items or [])
+    return order
     
     
 async def orm_get_orders(session: AsyncSession):
     query = select(Order)
     result = await session.execute(query)
-    return result.scalars().all()
\ No newline at end of file
+    return result.scalars().all()
+
+
+
+###################################### СТАТИСТИКА #################################
+
+# Инкремент дневной сводки за сегодня одним upsert'ом: orm_add_daily_stats(session, orders=1, revenue=10.5)
+async def orm_add_daily_stats(session: AsyncSession, **increments):
+    values = {"day": date.today(), "orders": 0, "revenue": 0, "new_users": 0, **increments}
+    query = _insert(session, DailyStats).values(values).on_conflict_do_update(
+        index_elements=[DailyStats.day],
+        set_={
+            **{name: getattr(DailyStats, name) + value for name, value in increments.items()},
+            "updated": func.now(),
+        },
+    )
+    await session.execute(query)
+
+
+async def orm_add_daily_product_stats(session: AsyncSession, items: list[dict]):
+    day = date.today()
+    rows = [
+        {
+            "day": day,
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            "revenue": item["quantity"] * item["price"],
+        }
+        for item in items
+        if item.get("product_id") is not None
+    ]
+    if not rows:
+        return
+
+    query = _insert(session, DailyProductStats).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[DailyProductStats.day, DailyProductStats.product_id],
+        set_={
+            "quantity": DailyProductStats.quantity + query.excluded.quantity,
+            "revenue": DailyProductStats.revenue + query.excluded.revenue,
+            "updated": func.now(),
+        },
+    )
+    await session.execute(query)
+
+
+# Самые продаваемые товары начиная с дня since (запрос отдельно нужен plan_check).
+# Сводки сначала агрегируются по диапазону дней, и только limit лучших соединяются с product.
+# Диапазон ограничен с двух сторон: с одной границей SQLite без статистики считает его
+# широким и идет по индексу product_id (ради GROUP BY) через всю таблицу вместо первичного ключа (day, product_id)
+def top_products_query(since: date, limit: int):
+    top_quantity = func.sum(DailyProductStats.quantity).label("quantity")
+    top = (
+        select(DailyProductStats.product_id, top_quantity, func.sum(DailyProductStats.revenue).label("revenue"))
+        .where(DailyProductStats.day.between(since, date.today()))
+        .group_by(DailyProductStats.product_id)
+        .order_by(top_quantity.desc())
+        .limit(limit)
+        .subquery()
+    )
+    return (
+        select(Product.name, top.c.quantity, top.c.revenue)
+        .select_from(top)
+        .join(Product, Product.id == top.c.product_id)
+        .order_by(top.c.quantity.desc())
+    )
+
+
+# Статистика для админки: итоги за все время и сводки за периоды (в днях, включая сегодня)
+# считаются одним запросом по daily_stats - строка на день, а не COUNT/SUM по order и user
+async def orm_get_statistics(session: AsyncSession, periods: tuple[int, ...] = (1, 7, 30), top_limit: int = 5):
+    today = date.today()
+    since = {days: today - timedelta(days=days - 1) for days in periods}
+    columns = [
+        func.coalesce(func.sum(DailyStats.new_users), 0),
+        func.coalesce(func.sum(DailyStats.orders), 0),
+        func.coalesce(func.sum(DailyStats.revenue), 0),
+    ]
+    for days in periods:
+        in_period = DailyStats.day >= since[days]
+        columns += [
+            func.coalesce(func.sum(case((in_period, DailyStats.orders), else_=0)), 0),
+            func.coalesce(func.sum(case((in_period, DailyStats.revenue), else_=0)), 0),
+            func.coalesce(func.sum(case((in_period, DailyStats.new_users), else_=0)), 0),
+        ]
+    users_count, orders_count, revenue, *row = (await session.execute(select(*columns))).one()
+
+    period_stats = {}
+    for index, days in enumerate(periods):
+        orders, period_revenue, new_users = row[index * 3:index * 3 + 3]
+        period_stats[days] = {
+            "orders": orders,
+            "revenue": period_revenue,
+            "new_users": new_users,
+            "average_basket": period_revenue / orders if orders else 0,
+        }
+
+    top_products = (await session.execute(top_products_query(since[max(periods)], top_limit))).all()
+
+    return {
+        "users": users_count,
+        "orders": orders_count,
+        "revenue": revenue,
+        "periods": period_stats,
+        "top_products": top_products,
+    }
+
+
+# Полный пересчет сводок по таблицам order, user и order_item (после переноса старых заказов
+# или загрузки синтетических данных). Агрегаты считаются и вставляются на стороне БД (INSERT ... SELECT),
+# без выгрузки дней и пар день/товар в Python - на миллионах заказов их тоже миллионы
+async def orm_rebuild_daily_stats(session: AsyncSession):
+    await session.execute(delete(DailyProductStats))
+    await session.execute(delete(DailyStats))
+
+    order_day = func.date(Order.created)
+    user_day = func.date(User.created)
+    days = union_all(
+        select(
+            order_day.label("day"),
+            func.count().label("orders"),
+            func.sum(Order.total_price).label("revenue"),
+            literal(0).label("new_users"),
+        ).group_by(order_day),
+        select(user_day, literal(0), literal(0.0), func.count()).group_by(user_day),
+    ).subquery()
+    query = select(
+        days.c.day,
+        func.sum(days.c.orders),
+        func.sum(days.c.revenue),
+        func.sum(days.c.new_users),
+    ).group_by(days.c.day)
+    await session.execute(insert(DailyStats).from_select(["day", "orders", "revenue", "new_users"], query))
+
+    query = (
+        select(
+            order_day,
+            OrderItem.product_id,
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.quantity * OrderItem.price),
+        )
+        .select_from(OrderItem)
+        .join(OrderItem.order)
+        .where(OrderItem.product_id.is_not(None))
+        .group_by(order_day, OrderItem.product_id)
+    )
+    await session.execute(
+        insert(DailyProductStats).from_select(["day", "product_id", "quantity", "revenue"], query)
+    )
+
+
+
+###################################### FSM #################################
+
+async def orm_get_fsm_state(session: AsyncSession, key: str):
+    query = select(FSMState).where(FSMState.key == key)
+    result = await session.execute(query)
+    return result.scalar()
+
+
+# Пишет только переданные поля (state и/или data). Пустое состояние (после state.clear()) удаляется
+async def orm_set_fsm_state(session: AsyncSession, key: str, **values):
+    if values.get("state", "") is None and values.get("data") == {}:
+        await session.execute(delete(FSMState).where(FSMState.key == key))
+        return
+
+    query = _insert(session, FSMState).values(key=key, **values).on_conflict_do_update(
+        index_elements=[FSMState.key],
+        set_={**values, "updated": func.now()},
+    )
+    await session.execute(query)
+
+
+
+###################################### АДМИНИСТРАТОРЫ #################################
+
+async def orm_get_admin_ids(session: AsyncSession) -> set[int]:
+    result = await session.scalars(select(Admin.user_id).distinct())
+    return set(result)
+
+
+# Секунды от момента в колонке timestamp без часового пояса до текущего времени БД.
+# Считается в SQL: в PostgreSQL now() - timestamptz, и вычитание в Python смешало бы
+# aware и naive datetime. LOCALTIMESTAMP - те же часы, что у default=func.now() колонки
+def _seconds_since(session: AsyncSession, moment):
+    if session.bind.dialect.name == 'sqlite':
+        return (func.julianday('now') - func.julianday(moment)) * 86400
+    return func.extract('epoch', func.localtimestamp() - moment)
+
+
+# Группы с админами и сколько секунд назад их список обновлялся (по часам БД)
+async def orm_get_admin_chats(session: AsyncSession) -> dict[int, float]:
+    query = select(Admin.chat_id, _seconds_since(session, func.max(Admin.updated))).group_by(Admin.chat_id)
+    result = await session.execute(query)
+    return {chat_id: float(age) for chat_id, age in result.all()}
+
+
+# Заменяет список админов группы: ушедших удаляет, остальным обновляет статус и время
+async def orm_set_chat_admins(session: AsyncSession, chat_id: int, admins: dict[int, str]):
+    await session.execute(delete(Admin).where(Admin.chat_id == chat_id, Admin.user_id.not_in(admins)))
+    if not admins:
+        return
+
+    query = _insert(session, Admin).values([
+        {"chat_id": chat_id, "user_id": user_id, "status": status}
+        for user_id, status in admins.items()
+    ])
+    query = query.on_conflict_do_update(
+        index_elements=[Admin.chat_id, Admin.user_id],
+        set_={"status": query.excluded.status, "updated": func.now()},
+    )
+    await session.execute(query)
+
+
+# Удаляет админов групп, которых нет в списке разрешенных
+async def orm_delete_admin_chats_except(session: AsyncSession, chat_ids: set[int]) -> int:
+    result = await session.execute(delete(Admin).where(Admin.chat_id.not_in(chat_ids)))
+    return result.rowcount
+
+
+
+###################################### РАССЫЛКИ #################################
+
+async def orm_create_campaign(
+    session: AsyncSession, text: str | None, image: str | None, admin_chat_id: int, report_message_id: int | None = None
+) -> Campaign:
+    total = await session.scalar(select(func.count()).select_from(User).where(User.is_blocked.is_(False)))
+    campaign = Campaign(
+        text=text,
+        image=image,
+        admin_chat_id=admin_chat_id,
+        report_message_id=report_message_id,
+        total=total,
+        status='running',
+    )
+    session.add(campaign)
+    await session.flush()
+    return campaign
+
+
+async def orm_get_campaign(session: AsyncSession, campaign_id: int) -> Campaign | None:
+    return await session.get(Campaign, campaign_id)
+
+
+async def orm_get_running_campaigns(session: AsyncSession) -> list[Campaign]:
+    result = await session.scalars(select(Campaign).where(Campaign.status == 'running').order_by(Campaign.id))
+    return list(result)
+
+
+# Получатели рассылки после after_id (keyset по User.id) через серверный курсор:
+# драйвер отдает строки пачками по batch_size, а не загружает весь результат в память
+async def orm_stream_broadcast_users(session: AsyncSession, after_id: int, limit: int, batch_size: int = 100):
+    query = (
+        select(User.id, User.user_id)
+        .where(User.id > after_id, User.is_blocked.is_(False))
+        .order_by(User.id)
+        .limit(limit)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await session.stream(query)
+    async for batch in result.partitions():
+        yield batch
+
+
+# Время аренды рассылок - UTC процесса (часы серверов бота синхронизированы)
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Захват рассылки процессом owner: удается, только если она еще идет и ее никто не ведет
+# (аренда свободна или истекла). Проверка и захват - один UPDATE, поэтому из нескольких
+# процессов рассылку получает ровно один
+async def orm_claim_campaign(session: AsyncSession, campaign_id: int, owner: str, lease: float) -> bool:
+    now = _utcnow()
+    query = (
+        update(Campaign)
+        .where(
+            Campaign.id == campaign_id,
+            Campaign.status == 'running',
+            or_(Campaign.lease_until.is_(None), Campaign.lease_until < now, Campaign.owner == owner),
+        )
+        .values(owner=owner, lease_until=now + timedelta(seconds=lease))
+        .returning(Campaign.id)
+    )
+    return await session.scalar(query) is not None
+
+
+# Сохраняет прогресс, продлевает аренду и возвращает текущий статус рассылки (ее могли отменить
+# из другого процесса). None - аренду перехватил другой процесс, продолжать нельзя
+async def orm_save_campaign_progress(
+    session: AsyncSession,
+    campaign_id: int,
+    owner: str,
+    lease: float,
+    last_user_id: int,
+    sent: int = 0,
+    failed: int = 0,
+    blocked: int = 0,
+) -> str | None:
+    query = (
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.owner == owner)
+        .values(
+            last_user_id=last_user_id,
+            sent=Campaign.sent + sent,
+            failed=Campaign.failed + failed,
+            blocked=Campaign.blocked + blocked,
+            lease_until=_utcnow() + timedelta(seconds=lease),
+        )
+        .returning(Campaign.status)
+    )
+    return await session.scalar(query)
+
+
+# Отпускает аренду, чтобы рассылку сразу подхватил другой процесс (например, при остановке бота)
+async def orm_release_campaigns(session: AsyncSession, owner: str, campaign_ids: list[int] | None = None):
+    query = update(Campaign).where(Campaign.owner == owner).values(owner=None, lease_until=None)
+    if campaign_ids is not None:
+        query = query.where(Campaign.id.in_(campaign_ids))
+    await session.execute(query)
+
+
+async def orm_set_campaign_status(session: AsyncSession, campaign_id: int, status: str, from_status: str | None = None):
+    query = update(Campaign).where(Campaign.id == campaign_id).values(status=status)
+    if from_status is not None:
+        query = query.where(Campaign.status == from_status)
+    await session.execute(query)
+
+
+async def orm_mark_users_blocked(session: AsyncSession, user_ids: list[int]):
+    if user_ids:
+        await session.execute(update(User).where(User.user_id.in_(user_ids)).values(is_blocked=True))
@@ -0,0 +1,169 @@
+# Проверка планов горячих запросов из orm_query.py: если какой-то из них пойдет
+# полным проходом по таблице (Seq Scan в PostgreSQL, SCAN в SQLite), скрипт завершится с кодом 1.
+# Запросы не копируются сюда руками: настоящие orm_* функции вызываются на тестовых строках
+# внутри транзакции, которая в конце откатывается, а их SQL записывается из событий соединения
+# и отправляется в EXPLAIN как есть, с теми же параметрами.
+# Запуск: DATABASE_URL=... python -m app.database.plan_check
+import asyncio
+import sys
+from datetime import date
+from types import SimpleNamespace
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.database.cache import catalog_cache
+from app.database.models import Base, Cart, Category, Order, OrderItem, Product, User
+from app.database.orm_query import (
+    orm_add_user,
+    orm_delete_from_cart,
+    orm_get_cart_summary,
+    orm_get_fsm_state,
+    orm_get_product,
+    orm_get_products_page,
+    orm_get_user_cart_page,
+    orm_reduce_product_in_cart,
+    top_products_query,
+)
+
+
+# Баннеры BannerCache грузит целиком одним запросом по крошечной таблице - их здесь нет
+HOT_QUERIES = {
+    "orm_get_products_page": lambda session, rows: orm_get_products_page(session, rows.category_id, page=1),
+    "orm_get_product": lambda session, rows: orm_get_product(session, rows.product_id),
+    "orm_add_user": lambda session, rows: orm_add_user(session, rows.user_id),
+    "orm_get_user_cart_page": lambda session, rows: orm_get_user_cart_page(session, rows.user_id, page=1),
+    "orm_get_cart_summary": lambda session, rows: orm_get_cart_summary(session, rows.user_id),
+    # Количество в корзине 1 - выполняются обе ветки: UPDATE ... RETURNING и DELETE
+    "orm_reduce_product_in_cart": lambda session, rows: orm_reduce_product_in_cart(session, rows.user_id, rows.product_id),
+    "orm_delete_from_cart": lambda session, rows: orm_delete_from_cart(session, rows.user_id, rows.product_id),
+    "orm_get_fsm_state": lambda session, rows: orm_get_fsm_state(session, "plan_check"),
+    "orm_get_statistics (top products)": lambda session, rows: session.execute(top_products_query(date.today(), 5)),
+}
+
+
+# Каскадное удаление (ON DELETE CASCADE / SET NULL) ищет строки по внешнему ключу -
+# без индекса на нем удаление товара или пользователя проходит всю таблицу
+def _foreign_key_lookups() -> dict:
+    lookups = {}
+    for table in Base.metadata.sorted_tables:
+        for foreign_key in table.foreign_keys:
+            column = foreign_key.parent
+            lookups[f"{table.name}.{column.name}"] = (
+                lambda session, rows, table=table, column=column: session.execute(select(table).where(column == 0))
+            )
+    return lookups
+
+
+# Строки, на которых вызываются горячие функции. Ключи - отрицательные, чтобы не совпасть с живыми данными
+async def _create_rows(session: AsyncSession) -> SimpleNamespace:
+    category = Category(name="plan_check")
+    session.add(category)
+    await session.flush()
+    product = Product(name="plan_check", description="", price=1, image="", category_id=category.id)
+    user = User(user_id=-1)
+    session.add_all([product, user])
+    await session.flush()
+    order = Order(user_id=user.user_id, products="", phone="", address="", total_price=1)
+    session.add_all([order, Cart(user_id=user.user_id, product_id=product.id, quantity=1)])
+    await session.flush()
+    session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=1))
+    await session.flush()
+    return SimpleNamespace(category_id=category.id, product_id=product.id, user_id=user.user_id)
+
+
+async def _record(conn: AsyncConnection, queries: dict) -> dict[str, list[tuple[str, tuple]]]:
+    recorded = {}
+    current = []
+
+    def before_cursor_execute(sync_conn, cursor, statement, parameters, context, executemany):
+        current.append((statement, parameters))
+
+    session = AsyncSession(bind=conn, expire_on_commit=False)
+    rows = await _create_rows(session)
+    event.listen(conn.sync_connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        for name, call in queries.items():
+            # Кэш каталога иначе отдал бы страницу без запроса в БД
+            catalog_cache.invalidate()
+            current.clear()
+            await call(session, rows)
+            recorded[name] = [
+                (statement, parameters) for statement, parameters in current
+                if statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "WITH")
+            ]
+    finally:
+        event.remove(conn.sync_connection, "before_cursor_execute", before_cursor_execute)
+    return recorded
+
+
+async def _explain_sqlite(conn: AsyncConnection, sql: str, parameters) -> tuple[list[str], list[str]]:
+    result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters)
+    plan = [row[-1] for row in result.all()]
+    # "SCAN (subquery-N)" и "SCAN <алиас>" после "MATERIALIZE <алиас>" - проход по результату
+    # подзапроса (оконные функции, агрегат с LIMIT), а не по таблице
+    subqueries = {line.split(None, 1)[1] for line in plan if line.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+    seq_scans = [
+        line for line in plan
+        if line.startswith("SCAN ") and not line.startswith("SCAN (")
+        and line[len("SCAN "):] not in subqueries
+        and "USING" not in line and "CONSTANT ROW" not in line
+    ]
+    return plan, seq_scans
+
+
+async def _explain_postgresql(conn: AsyncConnection, sql: str, parameters) -> tuple[list[str], list[str]]:
+    result = await conn.exec_driver_sql(f"EXPLAIN {sql}", parameters)
+    plan = [row[0] for row in result.all()]
+    seq_scans = [line for line in plan if "Seq Scan" in line]
+    return plan, seq_scans
+
+
+async def check_query_plans(engine: AsyncEngine) -> tuple[int, dict[str, list[str]]]:
+    queries = {**HOT_QUERIES, **_foreign_key_lookups()}
+    failures = {}
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            recorded = await _record(conn, queries)
+            if conn.dialect.name == 'postgresql':
+                explain = _explain_postgresql
+                # На маленьких таблицах планировщик всегда выбирает Seq Scan. С выключенным seqscan
+                # он все равно пойдет полным проходом, только если подходящего индекса нет
+                await conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            else:
+                explain = _explain_sqlite
+
+            for name, statements in recorded.items():
+                if not statements:
+                    failures[name] = ["no SQL recorded"]
+                for sql, parameters in statements:
+                    plan, seq_scans = await explain(conn, sql, parameters)
+                    if seq_scans:
+                        failures.setdefault(name, []).extend([sql, *plan])
+        finally:
+            await transaction.rollback()
+    return len(queries), failures
+
+
+async def main() -> int:
+    from app.database.engine import engine
+    from app.database.migrations import migrate
+
+    await migrate(engine)
+    total, failures = await check_query_plans(engine)
+    await engine.dispose()
+
+    for name, plan in failures.items():
+        print(f"FAIL {name}:")
+        for line in plan:
+            print(f"    {line}")
+    print(f"{total - len(failures)}/{total} hot queries use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    sys.exit(asyncio.run(main()))
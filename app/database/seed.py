@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from multiprocessing import get_context
+from time import perf_counter
+from typing import NamedTuple
+
+from sqlalchemy import Table, exists, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database.models import Base, Cart, Category, Order, OrderItem, Product, User
+
+
+logger = logging.getLogger(__name__)
+
+
+# Синтетические пользователи получают Telegram id начиная с USER_ID_BASE + 1 (user.user_id - обычный integer)
+USER_ID_BASE = 1_000_000_000
+
+FIRST_NAMES = ("Алексей", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Сергей", "Ольга", "Павел", "Наталья")
+LAST_NAMES = ("Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", "Козлов", "Новикова", None)
+PRODUCT_WORDS = ("Пицца", "Маргарита", "Пепперони", "Сырная", "Острая", "Рол", "Филадельфия", "Морс", "Лимонад", "Чизкейк")
+DESCRIPTION_WORDS = "тонкое тесто томатный соус моцарелла базилик бекон грибы халапеньо соус барбекю курица ананас".split()
+STREETS = ("Ленина", "Мира", "Садовая", "Советская", "Лесная", "Школьная", "Центральная", "Молодежная")
+
+
+class SeedConfig(NamedTuple):
+    categories: int
+    products: int
+    users: int
+    carts: int
+    orders: int
+    days: int
+    until: datetime
+    seed: int
+    batch_size: int
+
+
+# Каждая пачка строк генерируется своим Random(seed, стадия, номер пачки) - данные не зависят
+# от того, сколько процессов и в каком порядке их грузили
+def _random(config: SeedConfig, stage: str, chunk: int) -> random.Random:
+    return random.Random(f"{config.seed}:{stage}:{chunk}")
+
+
+def _chunks(total: int, batch_size: int) -> int:
+    return (total + batch_size - 1) // batch_size
+
+
+def _chunk_range(config: SeedConfig, total: int, chunk: int) -> range:
+    return range(chunk * config.batch_size + 1, min(total, (chunk + 1) * config.batch_size) + 1)
+
+
+def _moment(rnd: random.Random, config: SeedConfig, days: int) -> datetime:
+    return config.until - timedelta(seconds=rnd.randrange(days * 86400))
+
+
+######################### Генераторы строк ###############################################
+# Возвращают [(таблица, колонки, строки)] одной пачки. id задаются явно там, где на них ссылаются
+
+def _category_rows(config: SeedConfig, chunk: int):
+    rnd = _random(config, "category", chunk)
+    rows = []
+    for category_id in _chunk_range(config, config.categories, chunk):
+        created = _moment(rnd, config, config.days)
+        rows.append((category_id, f"Категория {category_id}", created, created))
+    return [(Category.__table__, ("id", "name", "created", "updated"), rows)]
+
+
+def _product_rows(config: SeedConfig, chunk: int):
+    rnd = _random(config, "product", chunk)
+    rows = []
+    for product_id in _chunk_range(config, config.products, chunk):
+        created = _moment(rnd, config, config.days)
+        rows.append((
+            product_id,
+            f"{rnd.choice(PRODUCT_WORDS)} {product_id}",
+            " ".join(rnd.choices(DESCRIPTION_WORDS, k=rnd.randint(4, 12))),
+            round(rnd.uniform(2, 60), 2),
+            f"seed-product-{product_id}",
+            rnd.randint(1, config.categories),
+            created,
+            created,
+        ))
+    columns = ("id", "name", "description", "price", "image", "category_id", "created", "updated")
+    return [(Product.__table__, columns, rows)]
+
+
+# Цены товаров нужны позициям заказов - пересчитываем их теми же генераторами, а не читаем из БД
+@lru_cache(maxsize=1)
+def _product_prices(config: SeedConfig) -> list[float]:
+    prices = [0.0]
+    for chunk in range(_chunks(config.products, config.batch_size)):
+        prices += [row[3] for row in _product_rows(config, chunk)[0][2]]
+    return prices
+
+
+def _user_rows(config: SeedConfig, chunk: int):
+    rnd = _random(config, "user", chunk)
+    rows = []
+    for user_id in _chunk_range(config, config.users, chunk):
+        created = _moment(rnd, config, config.days)
+        rows.append((
+            user_id,
+            USER_ID_BASE + user_id,
+            rnd.choice(FIRST_NAMES),
+            rnd.choice(LAST_NAMES),
+            f"+79{rnd.randrange(10 ** 9):09d}" if rnd.random() < 0.7 else None,
+            rnd.random() < 0.02,
+            created,
+            created,
+        ))
+    columns = ("id", "user_id", "first_name", "last_name", "phone", "is_blocked", "created", "updated")
+    return [(User.__table__, columns, rows)]
+
+
+# Корзины режутся по тем же пачкам пользователей: пачке достается ее доля от общего числа строк,
+# внутри пачки - случайно, от пустой корзины до двойной средней. Пара (user, product) не повторяется
+def _cart_rows(config: SeedConfig, chunk: int):
+    rnd = _random(config, "cart", chunk)
+    users = _chunk_range(config, config.users, chunk)
+    remaining = config.carts * (users.stop - 1) // config.users - config.carts * (users.start - 1) // config.users
+    rows = []
+    for position, user_id in enumerate(users):
+        users_left = len(users) - position
+        if users_left == 1:
+            count = remaining
+        else:
+            count = rnd.randint(0, 2 * remaining // users_left)
+        count = min(count, remaining, config.products)
+        remaining -= count
+        for product_id in rnd.sample(range(1, config.products + 1), count):
+            created = _moment(rnd, config, 30)
+            rows.append((USER_ID_BASE + user_id, product_id, rnd.randint(1, 5), created, created))
+    return [(Cart.__table__, ("user_id", "product_id", "quantity", "created", "updated"), rows)]
+
+
+# Заказы вместе с позициями. Часть пользователей заказывает заметно чаще остальных
+def _order_rows(config: SeedConfig, chunk: int):
+    rnd = _random(config, "order", chunk)
+    prices = _product_prices(config)
+    orders = []
+    items = []
+    for order_id in _chunk_range(config, config.orders, chunk):
+        user_id = USER_ID_BASE + 1 + int(config.users * rnd.random() ** 2)
+        created = _moment(rnd, config, config.days)
+        products = {rnd.randint(1, config.products): rnd.randint(1, 3)
+                    for _ in range(rnd.choices((1, 2, 3, 4), weights=(45, 30, 15, 10))[0])}
+        total = 0.0
+        for product_id, quantity in products.items():
+            items.append((order_id, product_id, quantity, prices[product_id], created, created))
+            total += prices[product_id] * quantity
+        orders.append((
+            order_id,
+            user_id,
+            "".join(f"{product_id}:{quantity};" for product_id, quantity in products.items()),
+            f"+79{rnd.randrange(10 ** 9):09d}",
+            f"ул. {rnd.choice(STREETS)}, д. {rnd.randint(1, 150)}, кв. {rnd.randint(1, 300)}",
+            round(total, 2),
+            created,
+            created,
+        ))
+    return [
+        (Order.__table__, ("id", "user_id", "products", "phone", "address", "total_price", "created", "updated"), orders),
+        (OrderItem.__table__, ("order_id", "product_id", "quantity", "price", "created", "updated"), items),
+    ]
+
+
+# Стадии в порядке внешних ключей: (имя, генератор, число пачек)
+def _stages(config: SeedConfig):
+    return [
+        ("category", _category_rows, _chunks(config.categories, config.batch_size)),
+        ("product", _product_rows, _chunks(config.products, config.batch_size)),
+        ("user", _user_rows, _chunks(config.users, config.batch_size)),
+        ("cart", _cart_rows, _chunks(config.users, config.batch_size) if config.carts else 0),
+        ("order", _order_rows, _chunks(config.orders, config.batch_size)),
+    ]
+
+#########################################################################################
+
+
+######################### Загрузка ###############################################
+
+# PostgreSQL через asyncpg - COPY, остальное - executemany одной пачкой
+async def _write(conn: AsyncConnection, table: Table, columns: tuple, rows: list):
+    if not rows:
+        return
+    if conn.dialect.driver == "asyncpg":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=rows, columns=columns)
+    else:
+        await conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+# Каждая пачка - отдельная транзакция
+async def _load_chunks(stage: str, chunks: list[int], config: SeedConfig) -> int:
+    from app.database.engine import engine
+
+    generate = {name: generate for name, generate, _ in _stages(config)}[stage]
+    written = 0
+    try:
+        for chunk in chunks:
+            async with engine.begin() as conn:
+                for table, columns, rows in generate(config, chunk):
+                    await _write(conn, table, columns, rows)
+                    written += len(rows)
+    finally:
+        await engine.dispose()
+    return written
+
+
+def _load_part(stage: str, chunks: list[int], config: SeedConfig) -> int:
+    return asyncio.run(_load_chunks(stage, chunks, config))
+
+
+async def prepare(drop: bool):
+    from app.common.texts_for_db import description_for_info_pages
+    from app.database.engine import engine, session_maker
+    from app.database.migrations import migrate
+    from app.database.orm_query import orm_add_banner_description
+
+    try:
+        if drop:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        await migrate(engine)
+
+        async with session_maker() as session:
+            if await session.scalar(select(exists().where(Product.id.is_not(None)))) \
+                    or await session.scalar(select(exists().where(User.id.is_not(None)))):
+                raise SystemExit("В базе уже есть товары или пользователи - запустите с --drop, чтобы пересоздать ее")
+            await orm_add_banner_description(session, description_for_info_pages)
+            await session.commit()
+    finally:
+        await engine.dispose()
+
+
+# id вставлялись явно - сдвигаем последовательности PostgreSQL, обновляем статистику планировщика
+# и пересчитываем дневные сводки для экрана статистики
+async def finish(rebuild_stats: bool):
+    from app.database.engine import engine, session_maker
+    from app.database.orm_query import orm_rebuild_daily_stats
+
+    try:
+        async with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                for table in (Category.__table__, Product.__table__, User.__table__, Order.__table__):
+                    name = conn.dialect.identifier_preparer.format_table(table)
+                    await conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), coalesce(max(id), 1)) FROM {name}"
+                    ))
+
+        if rebuild_stats:
+            async with session_maker() as session:
+                await orm_rebuild_daily_stats(session)
+                await session.commit()
+
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+    finally:
+        await engine.dispose()
+
+
+# Загрузка синтетического набора данных для проверки запросов на реальных объемах.
+# Пачки одной стадии раздаются jobs процессам, стадии идут по очереди (внешние ключи)
+def seed(config: SeedConfig, jobs: int = 1, drop: bool = False, rebuild_stats: bool = True):
+    asyncio.run(prepare(drop))
+
+    started = perf_counter()
+    context = get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) if jobs > 1 else _Inline() as pool:
+        for stage, _, chunks in _stages(config):
+            if not chunks:
+                continue
+            stage_started = perf_counter()
+            parts = [list(range(chunks))[job::jobs] for job in range(min(jobs, chunks))]
+            written = sum(pool.map(_load_part, [stage] * len(parts), parts, [config] * len(parts)))
+            elapsed = perf_counter() - stage_started
+            logger.info("%s: %s rows in %.1f s (%.0f rows/s)", stage, written, elapsed, written / elapsed)
+
+    stats_started = perf_counter()
+    asyncio.run(finish(rebuild_stats))
+    logger.info("Sequences, daily stats and ANALYZE in %.1f s", perf_counter() - stats_started)
+    logger.info("Seeded in %.1f s", perf_counter() - started)
+
+
+# Заменяет пул процессов при --jobs 1
+class _Inline:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @staticmethod
+    def map(function, *iterables):
+        return map(function, *iterables)
+
+#########################################################################################
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load a reproducible synthetic dataset into DATABASE_URL")
+    parser.add_argument("--categories", type=int, default=300)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--carts", type=int, default=5_000_000, help="cart rows")
+    parser.add_argument("--orders", type=int, default=10_000_000, help="orders, each with 1-4 order_item rows")
+    parser.add_argument("--days", type=int, default=365, help="history length for created timestamps")
+    parser.add_argument("--until", type=date.fromisoformat, default=date.today(), help="last day of history, YYYY-MM-DD")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=50_000, help="rows per generated chunk and transaction")
+    parser.add_argument("--jobs", type=int, default=1, help="loader processes (PostgreSQL only)")
+    parser.add_argument("--drop", action="store_true", help="drop all tables first")
+    parser.add_argument("--skip-stats", action="store_true", help="do not rebuild daily_stats")
+    args = parser.parse_args(argv)
+
+    if args.categories < 1 or args.products < 1:
+        parser.error("at least one category and one product are required")
+    if args.carts > args.users * args.products:
+        parser.error("more cart rows than (user, product) pairs")
+    if args.orders and not args.users:
+        parser.error("orders require users")
+    return args
+
+
+def main():
+    args = parse_args()
+    config = SeedConfig(
+        categories=args.categories,
+        products=args.products,
+        users=args.users,
+        carts=args.carts,
+        orders=args.orders,
+        days=args.days,
+        until=datetime.combine(args.until, time.max).replace(microsecond=0),
+        seed=args.seed,
+        batch_size=args.batch_size,
+    )
+    jobs = args.jobs
+    # SQLite пишет одним писателем - параллельные загрузчики только ждали бы блокировку
+    if jobs > 1 and os.getenv('DATABASE_URL', '').startswith('sqlite'):
+        logger.warning("SQLite has a single writer, loading with one process")
+        jobs = 1
+    seed(config, jobs=jobs, drop=args.drop, rebuild_stats=not args.skip_stats)
+
+
+# Запуск: python -m app.database.seed [--products 50000 --categories 300 --users 1000000
+#                                      --carts 5000000 --orders 10000000] [--jobs 4] [--drop]
+if __name__ == '__main__':
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,10 +1,11 @@
 from aiogram.filters import Filter
-from aiogram import Bot
 from aiogram.types import Message
 
+from app.utils.admins import admin_registry
+
 class IsAdmin(Filter):
     def __init__(self) -> None:
         pass
 
-    async def __call__(self, message: Message, bot: Bot) -> bool:
-        return message.from_user.id in bot.my_admins_list
\ No newline at end of file
+    async def __call__(self, message: Message) -> bool:
+        return await admin_registry.is_admin(message.from_user.id)
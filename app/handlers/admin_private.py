@@ -1,27 +1,48 @@
-from aiogram import F, Router
-from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
-from aiogram.filters import Command, StateFilter, or_f
+import logging
+import math
+from contextlib import suppress
+
+from aiogram import F, Bot, Router, html
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, InputMediaPhoto
+from aiogram.filters import Command, CommandObject, StateFilter, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from app.database.orm_query import (orm_add_product, 
                                     orm_delete_product, 
                                     orm_get_categories, 
-                                    orm_get_product, orm_get_products, 
+                                    orm_get_product, orm_get_products_page, 
                                     orm_update_product,
                                     orm_get_info_pages,
                                     orm_change_banner_image,
-                                    orm_get_users,
-                                    orm_get_orders)
-from app.keyboards.inline import get_callback_btns
+                                    orm_get_statistics,
+                                    orm_create_campaign,
+                                    orm_set_campaign_status)
+from app.keyboards.inline import AdminProductCallBack, get_admin_products_btns, get_callback_btns
 from app.keyboards.reply import get_keyboard
 from app.filters.admin import IsAdmin
 from app.filters.chat_type import ChatTypeFilter
+from app.database.instrumentation import sql_instrumentation
+from app.utils.broadcast import broadcaster
+from app.utils.profanity import profanity_matcher
+from app.utils.shared_settings import shared_settings
+from app.utils.text import TELEGRAM_CAPTION_LIMIT
 
-admin_private_router = Router()
+logger = logging.getLogger(__name__)
+
+admin_private_router = Router(name="admin_private")
 admin_private_router.message.filter(ChatTypeFilter(['private']), IsAdmin())
+admin_private_router.callback_query.filter(IsAdmin())
+
+# Товаров на странице каталога админки - столько фото помещается в один альбом
+PRODUCTS_PER_PAGE = 10
+# Альбомы открытых страниц каталога в данных FSM: id сообщения с кнопками -> id сообщений альбома.
+# Telegram не обещает, что id сообщений альбома идут подряд, поэтому храним их явно
+PRODUCT_PAGES_KEY = "product_pages"
+PRODUCT_PAGES_LIMIT = 10
 
 
 ######################### КЛАВИАТУРЫ ###############################################
@@ -31,9 +52,10 @@ ADMIN_KB = get_keyboard(
     "Ассортимент",
     "Добавить/изменить баннер",
     "Статистика",
+    "Рассылка",
     "Выйти из админ панели",
     placehoder="Выберите действие",
-    sizes=(2, 2, 1)
+    sizes=(2, 2, 2)
 )
 
 state_process_kb = get_keyboard(
@@ -54,8 +76,9 @@ class AddProduct(StatesGroup):
     category = State()
     image = State()
 
-    
-    product_for_edit = None
+    # Изменяемый товар хранится в данных FSM под этим ключом, а не в атрибуте класса:
+    # иначе два админа, редактирующие товары одновременно, перетирали бы друг другу правку
+    product_for_edit = "product_for_edit"
     
     texts = {
         "AddProduct:name": "Введите название заново:",
@@ -74,6 +97,11 @@ class AddBanner(StatesGroup):
     image = State()
 
 
+class Broadcast(StatesGroup):
+    message = State()
+    confirmation = State()
+
+
 ######################### БАЗОВЫЕ ХЕНДЛЕРЫ ###############################################
 
 
@@ -82,25 +110,67 @@ async def admin_panel(message: Message):
     await message.answer("Вы зашли в админ панель", reply_markup=ADMIN_KB)
     
     
+# Команды ниже меняют состояние процесса - в режиме воркеров изменение
+# расходится по остальным процессам через shared_settings
+shared_settings.on_change("restricted_words", lambda value: profanity_matcher.reload())
+shared_settings.on_change("log_queries", lambda value: setattr(sql_instrumentation, "log_queries", bool(value)))
+
+
+# Перечитать список запрещенных слов без перезапуска бота
+@admin_private_router.message(Command("reload_words"))
+async def reload_restricted_words(message: Message):
+    shared_settings.set("restricted_words")
+    await message.answer("Список запрещенных слов обновлен")
+    
+    
+# Поштучный лог SQL-запросов: /sql_log on|off (без аргумента - переключить)
+@admin_private_router.message(Command("sql_log"))
+async def toggle_sql_log(message: Message, command: CommandObject):
+    if command.args in ("on", "off"):
+        log_queries = command.args == "on"
+    else:
+        log_queries = not sql_instrumentation.log_queries
+    shared_settings.set("log_queries", int(log_queries))
+    await message.answer(f"Лог SQL-запросов {'включен' if sql_instrumentation.log_queries else 'выключен'}")
+
+
+# Самые дорогие запросы по суммарному времени
+@admin_private_router.message(Command("sql_stats"))
+async def show_sql_stats(message: Message):
+    stats = sql_instrumentation.stats()
+    per_update = stats["queries_per_update"]
+    lines = [
+        f"Запросов: {stats['queries']}, медленных: {stats['slow_queries']}",
+        f"Запросов на апдейт: в среднем {per_update['avg']:.1f}, p95 {per_update['p95']}",
+    ]
+    for sql, histogram in sql_instrumentation.top_statements(limit=5):
+        lines.append(f"\n<code>{html.quote(sql[:300])}</code>\n"
+                     f"{histogram['count']} раз, всего {histogram['total']:.0f} мс, "
+                     f"p50 {histogram['p50']} мс, p99 {histogram['p99']} мс")
+    await message.answer("\n".join(lines))
+    
+    
 @admin_private_router.message(F.text=="Выйти из админ панели")
 async def leave_admin_panel(message: Message):
     await message.answer("Вы вышли из админ панели", reply_markup=ReplyKeyboardRemove())
         
         
-@admin_private_router.callback_query(F.data.startswith("delete_"))
-async def delete_product(callback: CallbackQuery, session: AsyncSession):
-    product_id = callback.data.split("_")[-1]
-    await orm_delete_product(session, int(product_id))
-    await callback.message.delete()
-    await callback.answer("Товар удален!")
-    
-    
-@admin_private_router.callback_query(StateFilter(None), F.data.startswith("edit_"))
-async def edit_product(callback: CallbackQuery, session: AsyncSession, state: FSMContext):
-    product_id = callback.data.split("_")[-1]
-    product_for_edit = await orm_get_product(session, int(product_id))
+# Изменение товара из каталога админки: исходные значения товара кладем в данные FSM
+@admin_private_router.callback_query(StateFilter(None), AdminProductCallBack.filter(F.action == "edit"))
+async def edit_product(callback: CallbackQuery, callback_data: AdminProductCallBack, session: AsyncSession, state: FSMContext):
+    product = await orm_get_product(session, callback_data.product_id)
+    await session.release()
+    if product is None:
+        await callback.answer("Товар уже удален", show_alert=True)
+        return
     
-    AddProduct.product_for_edit = product_for_edit
+    await state.update_data({AddProduct.product_for_edit: {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "image": product.image,
+    }})
     
     await callback.answer()
     await callback.message.answer("Введите новое название", reply_markup=state_process_kb)
@@ -128,21 +198,92 @@ async def show_products(message: Message, session: AsyncSession, state: FSMConte
                         reply_markup=get_callback_btns(btns=btns))
 
 
-@admin_private_router.callback_query(StateFilter(GetProduct.category_id))
+@admin_private_router.callback_query(StateFilter(GetProduct.category_id), F.data.isdigit())
 async def get_products(callback: CallbackQuery, session: AsyncSession, state: FSMContext):
     category_id = int(callback.data.split("_")[-1])
-    products = await orm_get_products(session, category_id)
-    await callback.message.delete()
-    for product in products:
-        await callback.message.answer_photo(product.image, 
-                                   caption=f"Название: {product.name}\n" +
-                                   f"Описание: {product.description}\n" +
-                                   f"Цена: {round(product.price, 2)}", 
-                                   reply_markup=get_callback_btns(btns={
-                                       "Удалить": f"delete_{product.id}",
-                                       "Изменить": f"edit_{product.id}"
-                                   }))
     await state.clear()
+    await callback.answer()
+    await callback.message.delete()
+    await send_products_page(callback.message, session, state, category_id, page=1)
+
+
+# Страница каталога: товары одним альбомом (до 10 фото) и сообщение со списком и кнопками.
+# Из БД читается только текущая страница
+async def send_products_page(message: Message, session: AsyncSession, state: FSMContext, category_id: int, page: int):
+    products, total = await orm_get_products_page(session, category_id, page, PRODUCTS_PER_PAGE)
+    await session.release()
+    pages = math.ceil(total / PRODUCTS_PER_PAGE)
+    if not products and page > 1:
+        # Удалили последний товар на последней странице - показываем предыдущую
+        page = pages or 1
+        products, total = await orm_get_products_page(session, category_id, page, PRODUCTS_PER_PAGE)
+        await session.release()
+    if not products:
+        await message.answer("Товары отсутствуют")
+        return
+
+    captions = [
+        f"{index}. {product.name}\nОписание: {product.description}\nЦена: {round(product.price, 2)}"[:TELEGRAM_CAPTION_LIMIT]
+        for index, product in enumerate(products, start=1)
+    ]
+    # Альбом должен состоять минимум из двух фото
+    if len(products) == 1:
+        album = [await message.answer_photo(products[0].image, caption=captions[0])]
+    else:
+        album = await message.answer_media_group([
+            InputMediaPhoto(media=product.image, caption=caption)
+            for product, caption in zip(products, captions)
+        ])
+
+    lines = [f"Страница {page} из {pages}"]
+    lines += [f"{index}. {product.name} - {round(product.price, 2)}$" for index, product in enumerate(products, start=1)]
+    keyboard_message = await message.answer(
+        "\n".join(lines),
+        reply_markup=get_admin_products_btns(
+            category=category_id,
+            page=page,
+            pages=pages,
+            product_ids=[product.id for product in products],
+        ),
+    )
+
+    product_pages = (await state.get_data()).get(PRODUCT_PAGES_KEY, {})
+    product_pages[str(keyboard_message.message_id)] = [photo.message_id for photo in album]
+    # Старые страницы, до которых админ уже не вернется, не храним
+    product_pages = dict(list(product_pages.items())[-PRODUCT_PAGES_LIMIT:])
+    await state.update_data({PRODUCT_PAGES_KEY: product_pages})
+
+
+# Убираем альбом и клавиатуру предыдущей страницы. Если альбом страницы не сохранился
+# (данные FSM сброшены), удаляем только сообщение с кнопками
+async def delete_products_page(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    product_pages = (await state.get_data()).get(PRODUCT_PAGES_KEY, {})
+    message_ids = product_pages.pop(str(callback.message.message_id), [])
+    await state.update_data({PRODUCT_PAGES_KEY: product_pages})
+    message_ids.append(callback.message.message_id)
+    # Сообщения старше 48 часов удалить нельзя - тогда просто показываем новую страницу ниже
+    with suppress(TelegramBadRequest):
+        await bot.delete_messages(callback.message.chat.id, message_ids)
+
+
+@admin_private_router.callback_query(AdminProductCallBack.filter(F.action == "page"))
+async def switch_products_page(
+    callback: CallbackQuery, callback_data: AdminProductCallBack, session: AsyncSession, state: FSMContext, bot: Bot
+):
+    await callback.answer()
+    await delete_products_page(callback, state, bot)
+    await send_products_page(callback.message, session, state, callback_data.category, callback_data.page)
+
+
+@admin_private_router.callback_query(AdminProductCallBack.filter(F.action == "delete"))
+async def delete_product(
+    callback: CallbackQuery, callback_data: AdminProductCallBack, session: AsyncSession, state: FSMContext, bot: Bot
+):
+    await orm_delete_product(session, callback_data.product_id)
+    await session.release()
+    await callback.answer("Товар удален!")
+    await delete_products_page(callback, state, bot)
+    await send_products_page(callback.message, session, state, callback_data.category, callback_data.page)
     
     
 #########################################################################################
@@ -178,6 +319,7 @@ async def add_banner_image(message: Message, state: FSMContext, session: AsyncSe
                          \n{', '.join(pages_names)}")
         return
     await orm_change_banner_image(session, for_page, image_id,)
+    await session.release()
     await message.answer("Баннер добавлен/изменен.", reply_markup=ADMIN_KB)
     await state.clear()
     
@@ -205,8 +347,6 @@ async def add_product(message: Message, state: FSMContext):
 async def reset_state(message: Message, state: FSMContext):
     
     current_state = await state.get_state()
-    if AddProduct.product_for_edit:
-        AddProduct.product_for_edit = None
     if current_state is None:
         return
     
@@ -242,8 +382,9 @@ async def get_back(message: Message, state: FSMContext, session: AsyncSession):
 # Ввод названия
 @admin_private_router.message(AddProduct.name, or_f(F.text, F.text == '.'))
 async def get_name(message: Message, state: FSMContext):
-    if message.text == '.' and AddProduct.product_for_edit is not None:
-        await state.update_data(name=AddProduct.product_for_edit.name)
+    product_for_edit = (await state.get_data()).get(AddProduct.product_for_edit)
+    if message.text == '.' and product_for_edit is not None:
+        await state.update_data(name=product_for_edit["name"])
     else:
         await state.update_data(name=message.text)
         
@@ -259,8 +400,9 @@ async def get_name(message: Message, state: FSMContext):
 # Ввод описания
 @admin_private_router.message(AddProduct.description, or_f(F.text, F.text == '.'))
 async def get_description(message: Message, state: FSMContext):
-    if message.text == '.' and AddProduct.product_for_edit is not None:
-        await state.update_data(description=AddProduct.product_for_edit.description)
+    product_for_edit = (await state.get_data()).get(AddProduct.product_for_edit)
+    if message.text == '.' and product_for_edit is not None:
+        await state.update_data(description=product_for_edit["description"])
     else:
         await state.update_data(description=message.text)
         
@@ -276,8 +418,9 @@ async def get_name(message: Message, state: FSMContext):
 # Ввод цены
 @admin_private_router.message(AddProduct.price, or_f(F.text, F.text == '.'))
 async def get_price(message: Message, state: FSMContext, session: AsyncSession):
-    if message.text == '.' and AddProduct.product_for_edit is not None:
-        await state.update_data(price=AddProduct.product_for_edit.price)
+    product_for_edit = (await state.get_data()).get(AddProduct.product_for_edit)
+    if message.text == '.' and product_for_edit is not None:
+        await state.update_data(price=product_for_edit["price"])
     else:
         try:
             await state.update_data(price=float(message.text))
@@ -317,29 +460,36 @@ async def get_category(message: Message):
 # Загрузка изображения
 @admin_private_router.message(AddProduct.image, or_f(F.photo, F.text == '.'))
 async def get_image(message: Message, state: FSMContext, session: AsyncSession):
-    if message.text == '.' and AddProduct.product_for_edit is not None:
-        await state.update_data(image=AddProduct.product_for_edit.image)
+    product_for_edit = (await state.get_data()).get(AddProduct.product_for_edit)
+    if message.text == '.' and product_for_edit is not None:
+        await state.update_data(image=product_for_edit["image"])
     else:
         await state.update_data(image=message.photo[-1].file_id)
         
     data = await state.get_data() 
         
+    # Ошибкой сохранения считается только запись в БД (вместе с коммитом в release),
+    # сбой ответа в Telegram после коммита товар уже не откатит
     try:
-        if AddProduct.product_for_edit:
-            await orm_update_product(session, AddProduct.product_for_edit.id, data)
-            await message.answer("Товар успешно изменен!", reply_markup=ADMIN_KB)
+        if product_for_edit:
+            await orm_update_product(session, product_for_edit["id"], data)
         else:
             await orm_add_product(session, data)
-            await message.answer_photo(data["image"],
-                                    caption=f"Название: {data['name']}\nОписание: {data['description']}\nЦена: {data['price']}")
-            await message.answer("Товар успешно добавлен!", reply_markup=ADMIN_KB)
-        await state.clear()
-    except Exception as e:
-        print(e)
+        await session.release()
+    except Exception:
+        logger.exception("Failed to save product %s", data.get("name"))
+        await session.rollback()
         await message.answer("Произошла ошибка. Попробуйте ещё раз", reply_markup=ADMIN_KB)
         await state.clear()
-        
-    AddProduct.product_for_edit = None
+        return
+
+    await state.clear()
+    if product_for_edit:
+        await message.answer("Товар успешно изменен!", reply_markup=ADMIN_KB)
+    else:
+        await message.answer_photo(data["image"],
+                                caption=f"Название: {data['name']}\nОписание: {data['description']}\nЦена: {data['price']}")
+        await message.answer("Товар успешно добавлен!", reply_markup=ADMIN_KB)
     
 # Хендлер для обработки некорректной загрузки изображения
 @admin_private_router.message(AddProduct.image)
@@ -353,12 +503,86 @@ async def get_name(message: Message, state: FSMContext):
 ################################# Статистика ######################################
 
 
+STATISTIC_PERIODS = {1: "Сегодня", 7: "За 7 дней", 30: "За 30 дней"}
+
+
 @admin_private_router.message(F.text == "Статистика")
 async def get_statistic(message: Message, session: AsyncSession):
-    users = await orm_get_users(session)
-    orders = await orm_get_orders(session)
-    
-    await message.answer(f"Всего пользоватей: {len(users)}\nВсего заказов: {len(orders)}")
-    
-    
-    
\ No newline at end of file
+    stats = await orm_get_statistics(session, periods=tuple(STATISTIC_PERIODS))
+    await session.release()
+    
+    lines = [
+        f"Всего пользоватей: {stats['users']}",
+        f"Всего заказов: {stats['orders']} на {round(stats['revenue'], 2)}$",
+    ]
+    for days, title in STATISTIC_PERIODS.items():
+        period = stats["periods"][days]
+        lines.append(f"\n<b>{title}</b>\n"
+                     f"Заказов: {period['orders']}\n"
+                     f"Выручка: {round(period['revenue'], 2)}$\n"
+                     f"Средний чек: {round(period['average_basket'], 2)}$\n"
+                     f"Новых пользователей: {period['new_users']}")
+    if stats["top_products"]:
+        lines.append("\n<b>Топ товаров за 30 дней</b>")
+        for index, product in enumerate(stats["top_products"], start=1):
+            lines.append(f"{index}. {product.name} - {product.quantity} шт. ({round(product.revenue, 2)}$)")
+    
+    await message.answer("\n".join(lines))
+
+
+#########################################################################################
+
+
+################################# Рассылка ######################################
+
+
+@admin_private_router.message(StateFilter(None), F.text == "Рассылка")
+async def start_broadcast(message: Message, state: FSMContext):
+    await message.answer("Отправьте сообщение для рассылки: текст или фото с подписью", reply_markup=get_keyboard("Отмена"))
+    await state.set_state(Broadcast.message)
+
+
+@admin_private_router.message(StateFilter(Broadcast.message), or_f(F.text, F.photo))
+async def get_broadcast_message(message: Message, state: FSMContext):
+    image = message.photo[-1].file_id if message.photo else None
+    text = message.html_text if (message.text or message.caption) else None
+    await state.update_data(text=text, image=image)
+    await state.set_state(Broadcast.confirmation)
+    if image:
+        await message.answer_photo(image, caption=text)
+    else:
+        await message.answer(text)
+    await message.answer("Так сообщение увидят пользователи. Запустить рассылку?",
+                         reply_markup=get_callback_btns(btns={"Запустить": "broadcast_start", "Отмена": "broadcast_cancel"}))
+
+
+@admin_private_router.callback_query(StateFilter(Broadcast.confirmation), F.data.in_({"broadcast_start", "broadcast_cancel"}))
+async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, session: AsyncSession,
+                            session_pool: async_sessionmaker, bot: Bot):
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer()
+    if callback.data == "broadcast_cancel":
+        await callback.message.edit_text("Рассылка отменена")
+        await callback.message.answer("Вы в админ панели", reply_markup=ADMIN_KB)
+        return
+
+    # Отчет о ходе рассылки Broadcaster обновляет в этом сообщении
+    campaign = await orm_create_campaign(session, data["text"], data["image"],
+                                         callback.message.chat.id, callback.message.message_id)
+    campaign_id, total = campaign.id, campaign.total
+    await session.release()
+
+    await callback.message.edit_text(f"Рассылка #{campaign_id} запущена, получателей: {total}",
+                                     reply_markup=get_callback_btns(btns={"Остановить": f"broadcast_cancel_{campaign_id}"}))
+    await callback.message.answer("Вы в админ панели", reply_markup=ADMIN_KB)
+    broadcaster.start(bot, session_pool, campaign_id)
+
+
+# Рассылку может выполнять другой процесс бота - он увидит отмену при сохранении прогресса
+@admin_private_router.callback_query(F.data.startswith("broadcast_cancel_"))
+async def cancel_broadcast(callback: CallbackQuery, session: AsyncSession):
+    campaign_id = int(callback.data.split("_")[-1])
+    await orm_set_campaign_status(session, campaign_id, 'cancelled', from_status='running')
+    await session.release()
+    await callback.answer("Рассылка будет остановлена")
@@ -6,8 +6,8 @@ from app.database.orm_query import (
     orm_delete_from_cart,
     orm_get_banner,
     orm_get_categories,
-    orm_get_products,
-    orm_get_user_carts,
+    orm_get_products_page,
+    orm_get_user_cart_page,
     orm_reduce_product_in_cart,
 )
 from app.keyboards.inline import (
@@ -51,9 +51,13 @@ def pages(paginator: Paginator):
 
 
 async def products(session, level, category, page):
-    products = await orm_get_products(session, category_id=category)
+    products, products_count = await orm_get_products_page(session, category_id=category, page=page)
+    # Товар могли удалить, пока пользователь листал - показываем последнюю страницу
+    if not products and products_count:
+        page = products_count
+        products, products_count = await orm_get_products_page(session, category_id=category, page=page)
 
-    paginator = Paginator(products, page=page)
+    paginator = Paginator(products, page=page, total=products_count)
     product = paginator.get_page()[0]
 
     image = InputMediaPhoto(
@@ -82,13 +86,16 @@ async def carts(session, level, menu_name, page, user_id, product_id):
         if page > 1:
             page -= 1
     elif menu_name == "decrement":
-        is_cart = await orm_reduce_product_in_cart(session, user_id, product_id)
-        if page > 1 and not is_cart:
+        quantity = await orm_reduce_product_in_cart(session, user_id, product_id)
+        if page > 1 and not quantity:
             page -= 1
     elif menu_name == "increment":
         await orm_add_to_cart(session, user_id, product_id)
 
-    carts = await orm_get_user_carts(session, user_id)
+    carts, carts_count, total_price = await orm_get_user_cart_page(session, user_id, page=page)
+    if not carts and carts_count:
+        page = carts_count
+        carts, carts_count, total_price = await orm_get_user_cart_page(session, user_id, page=page)
 
     if not carts:
         banner = await orm_get_banner(session, "cart")
@@ -104,14 +111,12 @@ async def carts(session, level, menu_name, page, user_id, product_id):
         )
 
     else:
-        paginator = Paginator(carts, page=page)
+        paginator = Paginator(carts, page=page, total=carts_count)
 
         cart = paginator.get_page()[0]
 
         cart_price = round(cart.quantity * cart.product.price, 2)
-        total_price = round(
-            sum(cart.quantity * cart.product.price for cart in carts), 2
-        )
+        total_price = round(total_price, 2)
         image = InputMediaPhoto(
             media=cart.product.image,
             caption=f"<strong>{cart.product.name}</strong>\n{cart.product.price}$ x {cart.quantity} = {cart_price}$\n" +
@@ -1,43 +1,31 @@
-from string import punctuation
-
 from aiogram import F, Bot, types, Router
 from aiogram.filters import Command
 
 from app.filters.chat_type import ChatTypeFilter
-from app.filters.admin import IsAdmin
-from app.common.restricted_words import restricted_words
+from app.utils.admins import admin_registry
+from app.utils.profanity import profanity_matcher
 
 
-user_group_router = Router()
+user_group_router = Router(name="user_group")
 user_group_router.message.filter(ChatTypeFilter(['group', 'supergroup']))
 user_group_router.edited_message.filter(ChatTypeFilter(['group', 'supergroup']))
 
 
+# Обновить список админов группы сразу, не дожидаясь фонового обновления реестра
 @user_group_router.message(Command("admin"))
 async def load_admins(message: types.Message, bot: Bot):
-    chat_id = message.chat.id
-    admins_list = await bot.get_chat_administrators(chat_id)
-    
-    admins_list = [
-        member.user.id
-        for member in admins_list
-        if member.status == 'creator' or member.status == 'administrator'
-    ]
-        
-    bot.my_admins_list = admins_list
-    
-    if message.from_user.id in admins_list:
+    if not await admin_registry.refresh_chat(bot, message.chat.id):
+        return
+
+    if await admin_registry.is_admin(message.from_user.id):
         await message.delete()
     
     
-def clean_text(text: str):
-    return text.translate(str.maketrans("", "", punctuation))
-
-
 @user_group_router.edited_message()
 @user_group_router.message()
 async def cleaner(message: types.Message):
-    if restricted_words.intersection(clean_text(message.text.lower()).split()):    
+    text = message.text or message.caption
+    if text and profanity_matcher.search(text):
         await message.delete()
         await message.answer(f'{message.from_user.full_name}, Соблюдайте порядок в чате!')
         
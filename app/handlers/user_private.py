@@ -9,16 +9,25 @@ import asyncio
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.orm_query import orm_add_to_cart, orm_add_user, orm_get_user_carts, orm_get_product, orm_add_order
+from app.database.orm_query import orm_add_to_cart, orm_add_user, orm_get_cart_summary, orm_add_order
 from app.filters.chat_type import ChatTypeFilter
 from app.handlers.menu_processing import get_menu_content
 from app.keyboards.inline import MenuCallBack, get_callback_btns
 from app.keyboards.reply import get_keyboard
+from app.middlewares.rate_limit import SendPriority, set_send_priority
+from app.utils.text import split_message
 
 
-user_private_router = Router()
+user_private_router = Router(name="user_private")
 user_private_router.message.filter(ChatTypeFilter(['private']))
 
+# Ответы по оформлению заказа уходят раньше листания каталога (app/middlewares/rate_limit.py)
+ORDER_PRIORITY = {"send_priority": SendPriority.HIGH}
+CATALOG_PRIORITY = {"send_priority": SendPriority.LOW}
+# Изменения корзины уже закоммичены к моменту ответа - их ответ нельзя отбрасывать
+# как листание каталога, иначе сообщение корзины покажет старое количество и сумму
+CART_ACTIONS = {"increment", "decrement", "delete"}
+
 @user_private_router.message(CommandStart())
 async def start_cmd(message: types.Message, session: AsyncSession):
     
@@ -32,6 +41,7 @@ async def start_cmd(message: types.Message, session: AsyncSession):
     )
     
     media, reply_markup = await get_menu_content(session, level=0, menu_name="main")
+    await session.release()
 
     await message.answer_photo(media.media, 
                                caption=media.caption, 
@@ -55,7 +65,7 @@ async def add_to_cart(callback: types.CallbackQuery, callback_data: MenuCallBack
     
     
 
-@user_private_router.callback_query(MenuCallBack.filter())
+@user_private_router.callback_query(MenuCallBack.filter(), flags=CATALOG_PRIORITY)
 async def user_menu(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession, state: FSMContext):
 
     if callback_data.menu_name == "add_to_cart":
@@ -63,9 +73,13 @@ async def user_menu(callback: types.CallbackQuery, callback_data: MenuCallBack,
         return
     
     if callback_data.menu_name == "order":
+        set_send_priority(SendPriority.HIGH)
         await form_order(callback, callback_data, state)
         return
 
+    if callback_data.menu_name in CART_ACTIONS:
+        set_send_priority(SendPriority.NORMAL)
+
     media, reply_markup = await get_menu_content(
         session,
         level=callback_data.level,
@@ -75,11 +89,13 @@ async def user_menu(callback: types.CallbackQuery, callback_data: MenuCallBack,
         product_id=callback_data.product_id,
         user_id=callback.from_user.id,
     )
+    await session.release()
 
+    # Отвечаем на колбэк до редактирования: отброшенная (SendDropped) правка не оставит кнопку в ожидании
+    await callback.answer()
     await callback.message.edit_media(media=media, 
                                       reply_markup=reply_markup, 
                                       parse_mode="HTML")
-    await callback.answer()
     
     
     
@@ -95,14 +111,14 @@ class GetOrder(StatesGroup):
     
     
     
-@user_private_router.message(StateFilter("*"), F.text.casefold() == "отмена")
+@user_private_router.message(StateFilter("*"), F.text.casefold() == "отмена", flags=ORDER_PRIORITY)
 async def cancel(message: types.Message, state: FSMContext, session: AsyncSession):
     await state.clear()
     await message.answer("Заказ отменен", reply_markup=ReplyKeyboardRemove())
     await start_cmd(message, session)
     
 
-@user_private_router.callback_query(MenuCallBack.filter())
+@user_private_router.callback_query(MenuCallBack.filter(), flags=ORDER_PRIORITY)
 async def form_order(callback: types.Message, callback_data: MenuCallBack, state: FSMContext):
     if callback_data.menu_name == "order":
         await callback.message.delete()
@@ -117,43 +133,55 @@ async def form_order(callback: types.Message, callback_data: MenuCallBack, state
         await callback.message.answer("Введите ваш номер телефона")
     
     
-@user_private_router.message(StateFilter(GetOrder.phone), F.text)
+@user_private_router.message(StateFilter(GetOrder.phone), F.text, flags=ORDER_PRIORITY)
 async def get_phone(message: types.Message, state: FSMContext):
     await state.update_data(phone=message.text)
     await message.answer("Введите ваш адрес")
     await state.set_state(GetOrder.address)
     
     
-@user_private_router.message(StateFilter(GetOrder.phone))
+@user_private_router.message(StateFilter(GetOrder.phone), flags=ORDER_PRIORITY)
 async def check_confirmation(message: types.Message):
     await message.answer("Неверный формат, введите номер заново")
     
     
-@user_private_router.message(StateFilter(GetOrder.address), F.text)
+def render_order_summary(data: dict, products, total_cost: float):
+    lines = [
+        "Информация о заказе:\n",
+        f"<b>Телефон</b>: {data['phone']}",
+        f"<b>Адрес</b>: {data['address']}\n",
+        "<b>Товары</b>:",
+    ]
+    for product in products:
+        lines.append("------------------------------\n" +
+                     f"Название: {product.name}\nЦена: {product.price}$\nКоличество: {product.quantity}")
+    lines.append("------------------------------\n")
+    lines.append("<i>Итого</i>: " + str(total_cost) + "$")
+    return "\n".join(lines)
+
+
+@user_private_router.message(StateFilter(GetOrder.address), F.text, flags=ORDER_PRIORITY)
 async def get_address(message: types.Message, state: FSMContext, session: AsyncSession):
     await state.update_data(address=message.text)
     
     data = await state.get_data()
-    products = await orm_get_user_carts(session, user_id=message.from_user.id)
-    total_cost = 0
-    
-    list_products = ''
-    
-    await message.answer(f"Информация о заказе:\n\n" +
-                         f"<b>Телефон</b>: {data['phone']}\n<b>Адрес</b>: {data['address']}\n\n" +
-                         "<b>Товары</b>:")
-    for product in products:
-        product_info = await orm_get_product(session, product_id=product.product_id)
-        await message.answer(f"------------------------------\n" +
-                             f"Название: {product_info.name}\nЦена: {product_info.price}$\nКоличество: {product.quantity}\n" +
-                             "------------------------------\n")
-        list_products += f"{product_info.id}:{product.quantity};"
-        total_cost += product_info.price * product.quantity
-    
-    await message.answer("<i>Итого</i>: " + str(total_cost) + "$")
+    products = await orm_get_cart_summary(session, user_id=message.from_user.id)
+    await session.release()
+
+    total_cost = sum(product.price * product.quantity for product in products)
+    list_products = ''.join(f"{product.product_id}:{product.quantity};" for product in products)
+    items = [
+        {"product_id": product.product_id, "quantity": product.quantity, "price": product.price}
+        for product in products
+    ]
+
+    # Вся сводка уходит одним сообщением, делится только если не влезает в лимит Telegram
+    for text in split_message(render_order_summary(data, products, total_cost)):
+        await message.answer(text)
     
     await state.update_data(user_id=int(message.from_user.id))
     await state.update_data(products=list_products)
+    await state.update_data(items=items)
     await state.update_data(total_price=total_cost)
     
     await asyncio.sleep(1)
@@ -164,17 +192,18 @@ async def get_address(message: types.Message, state: FSMContext, session: AsyncS
     await state.set_state(GetOrder.confirmation)
     
     
-@user_private_router.message(StateFilter(GetOrder.address))
+@user_private_router.message(StateFilter(GetOrder.address), flags=ORDER_PRIORITY)
 async def check_confirmation(message: types.Message):
     await message.answer("Неверный формат, введите адрес заново")
 
     
     
-@user_private_router.callback_query(StateFilter(GetOrder.confirmation), F.data)
+@user_private_router.callback_query(StateFilter(GetOrder.confirmation), F.data, flags=ORDER_PRIORITY)
 async def get_confirmation(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     if callback.data == "confirm":
         data = await state.get_data()
         await orm_add_order(session, data)
+        await session.release()
         await callback.message.answer_sticker('CAACAgIAAxkBAAIQFGYDxkqMP31aAiVSKLoSRPzhVsqfAAIcAQACMNSdEW7qjCmqrhdONAQ')
         await asyncio.sleep(1)
         await callback.answer("Заказ оформлен")
@@ -185,7 +214,7 @@ async def get_confirmation(callback: types.CallbackQuery, state: FSMContext, ses
     await start_cmd_callback(callback, session)
         
         
-@user_private_router.message(StateFilter(GetOrder.confirmation))
+@user_private_router.message(StateFilter(GetOrder.confirmation), flags=ORDER_PRIORITY)
 async def check_confirmation(message: types.Message):
     await message.answer("Нажмите на кнопку, чтобы подтвердить заказ")
         
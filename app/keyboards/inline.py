@@ -1,7 +1,11 @@
-from aiogram.types import InlineKeyboardButton
+from typing import Callable
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
 
+from app.database.cache import catalog_cache
+
 
 def get_callback_btns(
     *,
@@ -48,6 +52,50 @@ def get_inline_mix_btns(
     return keyboard.adjust(*sizes).as_markup()
 
 
+######################## Кэш клавиатур меню ########################
+
+# Клавиатуры меню полностью определяются своими аргументами, поэтому собираем
+# InlineKeyboardMarkup один раз и дальше отдаем готовый объект без InlineKeyboardBuilder и pack().
+# Разметка общая для всех пользователей - после получения ее нельзя изменять.
+# При смене версии каталога кэш очищается, чтобы не копить клавиатуры удаленных товаров
+class KeyboardCache:
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._markups: dict[tuple, InlineKeyboardMarkup] = {}
+        self._version = catalog_cache.version
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        if self._version != catalog_cache.version:
+            self.invalidate()
+
+        markup = self._markups.get(key)
+        if markup is not None:
+            self.hits += 1
+            return markup
+
+        self.misses += 1
+        if len(self._markups) >= self.maxsize:
+            self._markups.pop(next(iter(self._markups)))
+        markup = self._markups[key] = build()
+        return markup
+
+    def invalidate(self):
+        self._markups = {}
+        self._version = catalog_cache.version
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._markups),
+        }
+
+
+keyboard_cache = KeyboardCache()
+
+
 ######################## MENU keyboard ########################
 
 class MenuCallBack(CallbackData, prefix="menu"):
@@ -59,6 +107,13 @@ class MenuCallBack(CallbackData, prefix="menu"):
 
 
 def get_user_main_btns(*, level: int, sizes: tuple[int] = (2,)):
+    return keyboard_cache.get(
+        ("main", level, sizes),
+        lambda: _build_user_main_btns(level=level, sizes=sizes),
+    )
+
+
+def _build_user_main_btns(*, level: int, sizes: tuple[int]):
     keyboard = InlineKeyboardBuilder()
     btns = {
         "Товары 🍕": "catalog",
@@ -82,6 +137,14 @@ def get_user_main_btns(*, level: int, sizes: tuple[int] = (2,)):
 
 
 def get_user_catalog_btns(*, level: int, categories: list, sizes: tuple[int] = (2,)):
+    categories_key = tuple((c.id, c.name) for c in categories)
+    return keyboard_cache.get(
+        ("catalog", level, categories_key, sizes),
+        lambda: _build_user_catalog_btns(level=level, categories=categories, sizes=sizes),
+    )
+
+
+def _build_user_catalog_btns(*, level: int, categories: list, sizes: tuple[int]):
     keyboard = InlineKeyboardBuilder()
 
     keyboard.add(InlineKeyboardButton(text='Назад',
@@ -104,6 +167,28 @@ def get_products_btns(
     pagination_btns: dict,
     product_id: int,
     sizes: tuple[int] = (2, 1)
+):
+    return keyboard_cache.get(
+        ("products", level, category, page, tuple(pagination_btns.items()), product_id, sizes),
+        lambda: _build_products_btns(
+            level=level,
+            category=category,
+            page=page,
+            pagination_btns=pagination_btns,
+            product_id=product_id,
+            sizes=sizes,
+        ),
+    )
+
+
+def _build_products_btns(
+    *,
+    level: int,
+    category: int,
+    page: int,
+    pagination_btns: dict,
+    product_id: int,
+    sizes: tuple[int]
 ):
     keyboard = InlineKeyboardBuilder()
 
@@ -144,6 +229,27 @@ def get_user_cart(
     pagination_btns: dict | None,
     product_id: int | None,
     sizes: tuple[int] = (3,)
+):
+    pagination_key = tuple(pagination_btns.items()) if pagination_btns else None
+    return keyboard_cache.get(
+        ("cart", level, page, pagination_key, product_id, sizes),
+        lambda: _build_user_cart(
+            level=level,
+            page=page,
+            pagination_btns=pagination_btns,
+            product_id=product_id,
+            sizes=sizes,
+        ),
+    )
+
+
+def _build_user_cart(
+    *,
+    level: int,
+    page: int | None,
+    pagination_btns: dict | None,
+    product_id: int | None,
+    sizes: tuple[int]
 ):
     keyboard = InlineKeyboardBuilder()
     if page:
@@ -179,4 +285,45 @@ def get_user_cart(
             InlineKeyboardButton(text='На главную 🏠',
                     callback_data=MenuCallBack(level=0, menu_name='main').pack()))
         
-        return keyboard.adjust(*sizes).as_markup()
\ No newline at end of file
+        return keyboard.adjust(*sizes).as_markup()
+
+######################## Каталог в админке ########################
+
+class AdminProductCallBack(CallbackData, prefix="admin_product"):
+    action: str
+    category: int
+    page: int = 1
+    product_id: int | None = None
+
+
+# Кнопки "✏️ N" и "❌ N" по номеру товара в альбоме и переключение страниц
+def get_admin_products_btns(
+    *,
+    category: int,
+    page: int,
+    pages: int,
+    product_ids: list[int],
+    sizes: int = 5,
+):
+    keyboard = InlineKeyboardBuilder()
+
+    def callback(action: str, **kwargs) -> str:
+        return AdminProductCallBack(action=action, category=category, **kwargs).pack()
+
+    for action, icon in (("edit", "✏️"), ("delete", "❌")):
+        buttons = [
+            InlineKeyboardButton(text=f"{icon} {index}", callback_data=callback(action, page=page, product_id=product_id))
+            for index, product_id in enumerate(product_ids, start=1)
+        ]
+        for start in range(0, len(buttons), sizes):
+            keyboard.row(*buttons[start:start + sizes])
+
+    row = []
+    if page > 1:
+        row.append(InlineKeyboardButton(text="◀ Пред.", callback_data=callback("page", page=page - 1)))
+    if page < pages:
+        row.append(InlineKeyboardButton(text="След. ▶", callback_data=callback("page", page=page + 1)))
+    if row:
+        keyboard.row(*row)
+
+    return keyboard.as_markup()
@@ -3,13 +3,90 @@ from typing import Any, Awaitable, Callable, Dict
 from aiogram import BaseMiddleware
 from aiogram.types import Message, TelegramObject
 
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from app.database.instrumentation import SQLInstrumentation
 
+
+# Сессия открывается только при первом обращении хендлера к ней.
+# Апдейты, которым БД не нужна (модерация группы, попадания в кэш), не трогают пул вовсе
+class LazySession:
+    def __init__(self, session_pool: async_sessionmaker):
+        self._session_pool = session_pool
+        self._session: AsyncSession | None = None
+        self.used = False
+
+    def _get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_pool()
+            self.used = True
+        return self._session
+
+    def __getattr__(self, name: str):
+        return getattr(self._get_session(), name)
+
+    async def commit(self):
+        if self._session is not None:
+            await self._session.commit()
+
+    async def rollback(self):
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    # Хендлер закончил работу с БД (дальше asyncio.sleep и запросы к Telegram):
+    # коммитим накопленное и возвращаем соединение в пул. Следующее обращение откроет новую сессию
+    async def release(self):
+        await self.commit()
+        await self.close()
+
+
+# Unit of work: ORM-функции только делают flush, транзакцией апдейта владеет middleware -
+# один коммит в конце обработки или rollback при ошибке
 class DataBaseSession(BaseMiddleware):
     def __init__(self, session_pool: async_sessionmaker):
         self.session_pool = session_pool
+        self.updates = 0
+        self.db_updates = 0
+
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.updates += 1
+        session = LazySession(self.session_pool)
+        data['session'] = session
+        try:
+            result = await handler(event, data)
+            await session.commit()
+            return result
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            if session.used:
+                self.db_updates += 1
+            await session.close()
+
+    def stats(self) -> dict:
+        return {
+            "updates": self.updates,
+            "db_updates": self.db_updates,
+        }
+
 
+# Считает запросы к БД за весь апдейт, включая чтение и запись FSM,
+# поэтому регистрируется внешним middleware раньше остальных
+class SQLStatsMiddleware(BaseMiddleware):
+    def __init__(self, instrumentation: SQLInstrumentation):
+        self.instrumentation = instrumentation
 
     async def __call__(
         self,
@@ -17,6 +94,8 @@ class DataBaseSession(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
-            data['session'] = session
+        token = self.instrumentation.begin_update()
+        try:
             return await handler(event, data)
+        finally:
+            self.instrumentation.end_update(token)
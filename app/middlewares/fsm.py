@@ -0,0 +1,109 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.types import TelegramObject
+
+from app.database.fsm_storage import SQLAlchemyStorage
+from app.filters.chat_type import ChatTypeFilter
+
+
+# Замена встроенного FSMContextMiddleware для SQLAlchemyStorage:
+# - апдейты одного ключа FSM идут строго по очереди (events_isolation), а буфер состояний
+#   открывается и записывается в БД внутри этой блокировки. Иначе следующий апдейт чата,
+#   запущенный параллельно (handle_as_tasks), прочитал бы еще не записанное состояние;
+# - состояние читается из БД только если апдейт может попасть в хендлер с фильтром по состоянию.
+#   Какие типы событий и чатов этого требуют, собирает collect() по дереву роутеров
+class BufferedFSMContextMiddleware(FSMContextMiddleware):
+    storage: SQLAlchemyStorage
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # тип события -> типы чатов, где нужен raw_state (None - в любых чатах)
+        self._stateful: Dict[str, set[str] | None] | None = None
+        self.skipped = 0
+
+    @staticmethod
+    def _uses_state(callback: CallableObject) -> bool:
+        return "raw_state" in callback.params or callback.varkw
+
+    # Типы чатов, которыми роутер ограничил событие (ChatTypeFilter), None - без ограничения
+    @staticmethod
+    def _chat_types(callbacks: list[CallableObject]) -> set[str] | None:
+        chat_types = None
+        for callback in callbacks:
+            if isinstance(callback.callback, ChatTypeFilter):
+                types = set(callback.callback.chat_types)
+                chat_types = types if chat_types is None else chat_types & types
+        return chat_types
+
+    def collect(self, router: Router):
+        self._stateful = {}
+        self._collect(router, {})
+
+    def _collect(self, router: Router, parent_chat_types: Dict[str, set[str] | None]):
+        chat_types_by_event = {}
+        for event_type, observer in router.observers.items():
+            router_filters = observer._handler.filters or []
+            chat_types = self._chat_types(router_filters)
+            parent = parent_chat_types.get(event_type)
+            if parent is not None:
+                chat_types = parent if chat_types is None else chat_types & parent
+            chat_types_by_event[event_type] = chat_types
+
+            stateful = any(self._uses_state(callback) for callback in router_filters) or any(
+                self._uses_state(handler) or any(self._uses_state(callback) for callback in handler.filters or [])
+                for handler in observer.handlers
+            )
+            if not stateful:
+                continue
+            known = self._stateful.get(event_type, set())
+            self._stateful[event_type] = None if known is None or chat_types is None else known | chat_types
+
+        for sub_router in router.sub_routers:
+            self._collect(sub_router, chat_types_by_event)
+
+    def _needs_state(self, event: TelegramObject, data: Dict[str, Any]) -> bool:
+        if self._stateful is None:
+            return True
+        try:
+            event_type = event.event_type
+        except Exception:  # неизвестный aiogram'у тип апдейта
+            return True
+        if event_type not in self._stateful:
+            return False
+        chat_types = self._stateful[event_type]
+        chat = data.get("event_chat")
+        return chat_types is None or chat is None or chat.type in chat_types
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = self.resolve_event_context(data["bot"], data)
+        data["fsm_storage"] = self.storage
+        if not context:
+            return await handler(event, data)
+
+        async with self.events_isolation.lock(key=context.key):
+            token = self.storage.begin()
+            try:
+                data["state"] = context
+                if self._needs_state(event, data):
+                    data["raw_state"] = await context.get_state()
+                else:
+                    self.skipped += 1
+                return await handler(event, data)
+            finally:
+                try:
+                    await self.storage.flush()
+                finally:
+                    self.storage.end(token)
+
+    def stats(self) -> dict:
+        return {
+            "skipped_reads": self.skipped,
+        }
@@ -0,0 +1,121 @@
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+from app.database.instrumentation import SQLInstrumentation
+from app.utils.metrics import Metrics
+
+
+class _APITime:
+    __slots__ = ("time",)
+
+    def __init__(self):
+        self.time = 0.0
+
+
+# Время запросов к Telegram API за текущий апдейт
+_api_time: ContextVar[_APITime | None] = ContextVar("telegram_api_time", default=None)
+
+
+# Количество и длительность апдейтов по типу. Внешний middleware апдейта
+class UpdateMetricsMiddleware(BaseMiddleware):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = _api_time.set(_APITime())
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.metrics.observe_update(event.event_type, perf_counter() - started)
+            _api_time.reset(token)
+
+
+# Латентность хендлера и сколько из нее ушло на БД и на Telegram API.
+# Внутренний middleware - только он знает, какой хендлер и в каком роутере сработал
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, metrics: Metrics, instrumentation: SQLInstrumentation):
+        self.metrics = metrics
+        self.instrumentation = instrumentation
+        self._names: dict[Callable, str] = {}
+
+    # Метка хендлера - модуль и имя функции. В одном модуле бывает несколько хендлеров
+    # с одинаковым именем (шаги FSM) - тогда к метке добавляется строка определения
+    def handler_name(self, router: Router, callback: Callable) -> str:
+        name = self._names.get(callback)
+        if name is not None:
+            return name
+
+        name = f"{callback.__module__}.{callback.__qualname__}"
+        namesakes = {
+            handler.callback
+            for observer in router.observers.values()
+            for handler in observer.handlers
+            if f"{handler.callback.__module__}.{handler.callback.__qualname__}" == name
+        }
+        if len(namesakes) > 1:
+            name = f"{name}:{callback.__code__.co_firstlineno}"
+        self._names[callback] = name
+        return name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        router = data["event_router"].name
+        handler_name = self.handler_name(data["event_router"], data["handler"].callback)
+        queries = self.instrumentation.current_update()
+        api = _api_time.get()
+        db_before = queries.time if queries is not None else 0.0
+        api_before = api.time if api is not None else 0.0
+
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.metrics.observe_error(router, handler_name, e)
+            raise
+        finally:
+            self.metrics.observe_handler(
+                router,
+                handler_name,
+                perf_counter() - started,
+                db_time=queries.time - db_before if queries is not None else 0.0,
+                api_time=api.time - api_before if api is not None else 0.0,
+            )
+
+
+# Время самих HTTP-запросов к Bot API (без ожидания в RateLimiter, если зарегистрирован после него)
+class APITimingMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = perf_counter() - started
+            self.metrics.observe_api_call(method.__api_method__, elapsed)
+            api = _api_time.get()
+            if api is not None:
+                api.time += elapsed
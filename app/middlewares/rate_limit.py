@@ -0,0 +1,285 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from contextvars import ContextVar
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+
+logger = logging.getLogger(__name__)
+
+
+######################### Приоритеты отправки ###############################################
+
+# Меньше - важнее. Когда глобальный лимит исчерпан, первыми уходят запросы с меньшим приоритетом
+class SendPriority(IntEnum):
+    HIGH = 0      # оформление заказа
+    NORMAL = 1
+    LOW = 2       # листание каталога
+    BULK = 3      # рассылки
+
+
+# Отправка не дождалась бы своей очереди в чате за max_chat_wait и была отброшена (см. RateLimiter)
+class SendDropped(Exception):
+    pass
+
+
+send_priority: ContextVar[SendPriority] = ContextVar("send_priority", default=SendPriority.NORMAL)
+
+
+# Приоритет для хендлеров, которые решают его по ходу работы (например, меню, из которого начинается заказ)
+def set_send_priority(priority: SendPriority):
+    send_priority.set(priority)
+
+
+# Приоритет задается флагом хендлера: flags={"send_priority": SendPriority.HIGH}.
+# После хендлера прежнее значение восстанавливается. Отброшенная отправка (SendDropped)
+# завершает хендлер без ошибки - пользователь уже ушел дальше, чем бот успевает отвечать
+class SendPriorityMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = send_priority.set(get_flag(data, "send_priority", default=SendPriority.NORMAL))
+        try:
+            return await handler(event, data)
+        except SendDropped as e:
+            logger.info("%s", e)
+        finally:
+            send_priority.reset(token)
+
+#########################################################################################
+
+
+######################### Ограничитель запросов ###############################################
+
+# Токены копятся со скоростью rate в секунду, но не больше capacity.
+# reserve() всегда забирает токен (уходя в минус) и возвращает, сколько ждать своей очереди
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self, now: float):
+        # updated в будущем - бакет на паузе после retry_after
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        now = monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, self.updated - now) + max(0.0, -self.tokens / self.rate)
+
+    # Вернуть токен отмененной резервации
+    def cancel(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def try_take(self) -> bool:
+        now = monotonic()
+        self._refill(now)
+        if self.tokens >= 1 and self.updated <= now:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float):
+        now = monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        return self.updated <= now and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class LaneStats:
+    __slots__ = ("queued", "sent", "dropped", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.sent += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self) -> dict:
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "avg_wait": self.wait_total / self.sent if self.sent else 0.0,
+            "max_wait": self.wait_max,
+        }
+
+
+# Планировщик исходящих сообщений - middleware сессии бота, через него проходят все
+# message.answer/answer_photo/edit_media и т.д. Отправка ждет токен бакета своего чата
+# (личка ~1/с, группы ~20/мин), затем глобального (~30/с). Глобальные токены раздаются
+# по приоритету (SendPriority), внутри приоритета - по очереди. Очередь чата ограничена:
+# если ждать пришлось бы дольше max_chat_wait, отправки приоритетов из droppable отбрасываются
+# (SendDropped), остальные ждут. На 429 чат ставится на паузу retry_after, и запрос повторяется.
+# Telegram не сообщает, чей лимит исчерпан: если 429 приходит сразу в нескольких чатах,
+# это общий лимит бота, и на паузу встает глобальный бакет.
+# Остальные методы (getUpdates, answerCallbackQuery...) не ограничиваются
+class RateLimiter(BaseRequestMiddleware):
+    LIMITED_METHODS = ("send", "copy", "forward", "edit")
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        private_rate: float = 1,
+        private_burst: float = 3,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3,
+        max_retries: int = 3,
+        max_retry_after: float = 60,
+        max_chat_wait: float = 10,
+        droppable: tuple[SendPriority, ...] = (SendPriority.LOW,),
+    ):
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.max_chat_wait = max_chat_wait
+        self.droppable = droppable
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._pump: asyncio.Task | None = None
+        self._lanes = {priority: LaneStats() for priority in SendPriority}
+        self._reservations = 0
+        # Чаты под паузой после 429 -> когда она закончится
+        self._flooded: dict[int | str, float] = {}
+        self.retries = 0
+        self.global_pauses = 0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username - группы и каналы
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    # Бакеты чатов, которые полностью восстановились, не нужны - не копим их для каждого пользователя
+    def _forget_idle_chats(self):
+        now = monotonic()
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_idle(now)}
+
+    async def _acquire_global(self, priority: SendPriority):
+        if not self._waiters and self._global.try_take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    # Выдает глобальные токены ожидающим по мере их появления. Получателя выбираем
+    # уже после ожидания - за это время мог прийти более важный запрос
+    async def _run_pump(self):
+        while self._waiters:
+            delay = self._global.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _wait_turn(self, chat_id: int | str, priority: SendPriority):
+        lane = self._lanes[priority]
+        started = monotonic()
+        lane.queued += 1
+        try:
+            bucket = self._chat_bucket(chat_id)
+            delay = bucket.reserve()
+            if delay > self.max_chat_wait and priority in self.droppable:
+                bucket.cancel()
+                lane.dropped += 1
+                raise SendDropped(f"Send to chat {chat_id} dropped: queue wait {delay:.1f} s")
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+        finally:
+            lane.queued -= 1
+        lane.record(monotonic() - started)
+
+        self._reservations += 1
+        if self._reservations % 1000 == 0:
+            self._forget_idle_chats()
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(self.LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                if attempt == self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                logger.warning("Flood limit in chat %s, retry %s in %s s", chat_id, method.__api_method__, e.retry_after)
+                self._on_flood(chat_id, e.retry_after)
+
+    def _on_flood(self, chat_id: int | str, retry_after: float):
+        now = monotonic()
+        self._flooded = {flooded: until for flooded, until in self._flooded.items() if until > now}
+        if any(flooded != chat_id for flooded in self._flooded):
+            logger.warning("Flood limit in several chats, pausing all sends for %s s", retry_after)
+            self._global.pause(retry_after)
+            self.global_pauses += 1
+        self._flooded[chat_id] = now + retry_after
+        self._chat_bucket(chat_id).pause(retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "lanes": {priority.name.lower(): lane.as_dict() for priority, lane in self._lanes.items()},
+            "global_waiting": len(self._waiters),
+            "chats": len(self._chats),
+            "retries": self.retries,
+            "global_pauses": self.global_pauses,
+        }
+
+#########################################################################################
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database.cache import shared_invalidation
+from app.database.orm_query import (
+    orm_delete_admin_chats_except,
+    orm_get_admin_chats,
+    orm_get_admin_ids,
+    orm_set_chat_admins,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Реестр администраторов: список хранится в таблице admin, в памяти - frozenset для проверки за O(1).
+# Фоновая задача раз в ttl секунд перечитывает таблицу, а группы, чей список старше ttl,
+# обновляет через getChatAdministrators. Возраст считается по БД, поэтому при нескольких
+# процессах бота Telegram опрашивает только тот, кто первым заметил устаревший список.
+# Админы берутся только из групп ADMIN_CHATS; без списка админов нет ни у кого - иначе любой,
+# кто добавит бота в свою группу и отправит /admin, навсегда получил бы доступ к админке
+class AdminRegistry:
+    def __init__(self):
+        self._ids: frozenset[int] = frozenset()
+        self._stale = False
+        self._task: asyncio.Task | None = None
+        self.session_pool: async_sessionmaker | None = None
+        self.chats: set[int] = set()
+        self.ttl = 600
+        self.refreshes = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    def allowed(self, chat_id: int) -> bool:
+        return chat_id in self.chats
+
+    async def load(self):
+        self._stale = False
+        async with self.session_pool() as session:
+            self._ids = frozenset(await orm_get_admin_ids(session))
+
+    # Список сменил другой процесс (SharedInvalidation) - перечитываем его перед следующей проверкой
+    def invalidate(self):
+        self._stale = True
+
+    async def is_admin(self, user_id: int) -> bool:
+        if self._stale:
+            await self.load()
+        return user_id in self._ids
+
+    async def _store_chat_admins(self, bot: Bot, chat_id: int):
+        members = await bot.get_chat_administrators(chat_id)
+        admins = {
+            member.user.id: member.status
+            for member in members
+            if member.status in ('creator', 'administrator') and not member.user.is_bot
+        }
+        async with self.session_pool() as session:
+            await orm_set_chat_admins(session, chat_id, admins)
+            await session.commit()
+        self.refreshes += 1
+
+    # Обновление по команде из группы: остальные процессы узнают о нем через общий счетчик
+    async def refresh_chat(self, bot: Bot, chat_id: int) -> bool:
+        if not self.allowed(chat_id):
+            logger.warning("Chat %s is not in ADMIN_CHATS, admin refresh ignored", chat_id)
+            return False
+        await self._store_chat_admins(bot, chat_id)
+        await self.load()
+        shared_invalidation.publish()
+        return True
+
+    async def refresh(self, bot: Bot):
+        async with self.session_pool() as session:
+            dropped = await orm_delete_admin_chats_except(session, self.chats)
+            if dropped:
+                logger.warning("Dropped %s admins of chats not in ADMIN_CHATS", dropped)
+            await session.commit()
+            ages = await orm_get_admin_chats(session)
+
+        for chat_id in self.chats | set(ages):
+            if chat_id in ages and ages[chat_id] < self.ttl:
+                continue
+            try:
+                await self._store_chat_admins(bot, chat_id)
+            except TelegramAPIError as e:
+                logger.warning("Failed to refresh admins of chat %s: %s", chat_id, e)
+        await self.load()
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                await self.refresh(bot)
+            except Exception:
+                logger.exception("Admin registry refresh failed")
+            await asyncio.sleep(self.ttl)
+
+    async def start(self, bot: Bot, session_pool: async_sessionmaker, chats=(), ttl: int = 600):
+        self.session_pool = session_pool
+        self.chats = set(chats)
+        self.ttl = ttl
+        if not self.chats:
+            logger.warning("ADMIN_CHATS is not set - nobody has access to the admin panel")
+        shared_invalidation.subscribe(self.invalidate)
+        # Сохраненный список доступен сразу, обновление из Telegram идет уже в фоне
+        await self.load()
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "admins": len(self._ids),
+            "chats": len(self.chats),
+            "refreshes": self.refreshes,
+        }
+
+
+admin_registry = AdminRegistry()
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import suppress
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database.models import Campaign
+from app.database.orm_query import (
+    orm_claim_campaign,
+    orm_get_campaign,
+    orm_get_running_campaigns,
+    orm_mark_users_blocked,
+    orm_release_campaigns,
+    orm_save_campaign_progress,
+    orm_set_campaign_status,
+    orm_stream_broadcast_users,
+)
+from app.keyboards.inline import get_callback_btns
+from app.middlewares.rate_limit import SendPriority, set_send_priority
+
+
+logger = logging.getLogger(__name__)
+
+
+# Рассылка по таблице user. Получатели читаются окнами по window строк через серверный курсор
+# (соединение занято только на время чтения окна, а не всей рассылки), отправляются пачками
+# по batch_size параллельно - темп задает RateLimiter сессии бота (приоритет BULK, ниже ответов пользователям).
+# После каждой пачки прогресс пишется в campaign, поэтому после падения рассылка продолжается
+# с последней сохраненной пачки - повторно сообщение получит не больше batch_size пользователей.
+# Рассылку ведет только процесс, который захватил ее аренду (campaign.owner/lease_until) - при
+# нескольких процессах бота и во время выкладки новой версии она не отправляется дважды.
+# Аренда продлевается с каждой пачкой; рассылку остановленного или упавшего процесса
+# подхватывает фоновая проверка (watch) другого процесса, когда аренда истечет
+class Broadcaster:
+    STATUS_TITLES = {'running': "идет", 'done': "завершена", 'cancelled': "остановлена", 'failed': "прервана ошибкой"}
+
+    def __init__(self, batch_size: int = 100, window: int = 5000, report_interval: float = 30, lease: float = 120):
+        self.batch_size = batch_size
+        self.window = window
+        self.report_interval = report_interval
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.session_pool: async_sessionmaker | None = None
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+        self._watch: asyncio.Task | None = None
+        self._stopping = False
+
+    def start(self, bot: Bot, session_pool: async_sessionmaker, campaign_id: int):
+        self.session_pool = session_pool
+        if campaign_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, session_pool, campaign_id))
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda task: self._on_done(session_pool, campaign_id, task))
+
+    # Исключение в рассылке не должно пропасть молча, а сама она - навсегда остаться running
+    def _on_done(self, session_pool: async_sessionmaker, campaign_id: int, task: asyncio.Task):
+        self._tasks.pop(campaign_id, None)
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error("Campaign %s failed", campaign_id, exc_info=task.exception())
+        failed = asyncio.create_task(self._mark_failed(session_pool, campaign_id))
+        self._background.add(failed)
+        failed.add_done_callback(self._background.discard)
+
+    async def _mark_failed(self, session_pool: async_sessionmaker, campaign_id: int):
+        try:
+            async with session_pool() as session:
+                await orm_set_campaign_status(session, campaign_id, 'failed', from_status='running')
+                await orm_release_campaigns(session, self.owner, [campaign_id])
+                await session.commit()
+        except Exception:
+            logger.exception("Failed to mark campaign %s as failed", campaign_id)
+
+    # Рассылки, прерванные остановкой бота. Захватит их тот процесс, который успеет первым
+    async def resume(self, bot: Bot, session_pool: async_sessionmaker):
+        async with session_pool() as session:
+            campaigns = await orm_get_running_campaigns(session)
+        for campaign in campaigns:
+            self.start(bot, session_pool, campaign.id)
+
+    async def _run_watch(self, bot: Bot, session_pool: async_sessionmaker):
+        while True:
+            try:
+                await self.resume(bot, session_pool)
+            except Exception:
+                logger.exception("Failed to resume campaigns")
+            await asyncio.sleep(self.lease / 2)
+
+    # Проверка прерванных рассылок при запуске и затем каждые lease / 2 секунд
+    def watch(self, bot: Bot, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        self._watch = asyncio.create_task(self._run_watch(bot, session_pool))
+
+    # Статус остается running, аренда отпускается - рассылку сразу продолжит другой процесс
+    # или этот же после перезапуска. Текущей пачке дается timeout секунд, чтобы дописать прогресс
+    async def stop(self, timeout: float = 10):
+        if self._watch is not None:
+            self._watch.cancel()
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._background, return_exceptions=True)
+        if tasks:
+            try:
+                async with self.session_pool() as session:
+                    await orm_release_campaigns(session, self.owner)
+                    await session.commit()
+            except Exception:
+                logger.exception("Failed to release campaigns")
+
+    async def _send(self, bot: Bot, campaign: Campaign, chat_id: int) -> str:
+        try:
+            if campaign.image:
+                await bot.send_photo(chat_id, campaign.image, caption=campaign.text)
+            else:
+                await bot.send_message(chat_id, campaign.text)
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            # Удаленный аккаунт - получателя больше нет, как и у заблокировавшего бота
+            return "blocked" if "chat not found" in e.message.lower() else "failed"
+        except TelegramAPIError as e:
+            logger.warning("Campaign %s: failed to send to %s: %s", campaign.id, chat_id, e)
+            return "failed"
+
+    async def _report(self, bot: Bot, campaign: Campaign, done: int, rate: float, finished: bool = False):
+        if not campaign.report_message_id:
+            return
+        lines = [
+            f"Рассылка #{campaign.id}: {self.STATUS_TITLES.get(campaign.status, campaign.status)}",
+            f"Обработано: {done} из {campaign.total}",
+            f"Доставлено: {campaign.sent}, заблокировали бота: {campaign.blocked}, ошибок: {campaign.failed}",
+        ]
+        if not finished:
+            lines.append(f"Скорость: {rate:.1f} сообщ./с")
+            if rate > 0:
+                eta = max(campaign.total - done, 0) / rate
+                lines.append(f"Осталось примерно: {int(eta // 60)} мин {int(eta % 60)} с")
+        reply_markup = None if finished else get_callback_btns(btns={"Остановить": f"broadcast_cancel_{campaign.id}"})
+        # "message is not modified" и удаленное сообщение отчета рассылку не останавливают
+        with suppress(TelegramBadRequest):
+            await bot.edit_message_text(
+                "\n".join(lines),
+                chat_id=campaign.admin_chat_id,
+                message_id=campaign.report_message_id,
+                reply_markup=reply_markup,
+            )
+
+    async def _run(self, bot: Bot, session_pool: async_sessionmaker, campaign_id: int):
+        set_send_priority(SendPriority.BULK)
+        async with session_pool() as session:
+            claimed = await orm_claim_campaign(session, campaign_id, self.owner, self.lease)
+            await session.commit()
+            campaign = await orm_get_campaign(session, campaign_id) if claimed else None
+        if campaign is None:
+            return
+        logger.info("Campaign %s: sending from user %s", campaign.id, campaign.last_user_id)
+
+        started = monotonic()
+        last_report = started
+        done_at_start = campaign.sent + campaign.failed + campaign.blocked
+        last_user_id = campaign.last_user_id
+        status = campaign.status
+
+        while status == 'running':
+            async with session_pool() as session:
+                batches = [batch async for batch in orm_stream_broadcast_users(session, last_user_id, self.window, self.batch_size)]
+            if not batches:
+                break
+
+            for batch in batches:
+                results = await asyncio.gather(*(self._send(bot, campaign, row.user_id) for row in batch))
+                blocked_ids = [row.user_id for row, result in zip(batch, results) if result == "blocked"]
+                counts = {key: results.count(key) for key in ("sent", "failed", "blocked")}
+                last_user_id = batch[-1].id
+
+                async with session_pool() as session:
+                    status = await orm_save_campaign_progress(
+                        session, campaign.id, self.owner, self.lease, last_user_id, **counts
+                    )
+                    await orm_mark_users_blocked(session, blocked_ids)
+                    await session.commit()
+                if status is None:
+                    logger.warning("Campaign %s: lease was taken over by another process, stopping", campaign.id)
+                    return
+                if self._stopping:
+                    return
+                campaign.sent += counts["sent"]
+                campaign.failed += counts["failed"]
+                campaign.blocked += counts["blocked"]
+
+                now = monotonic()
+                if now - last_report >= self.report_interval:
+                    done = campaign.sent + campaign.failed + campaign.blocked
+                    await self._report(bot, campaign, done, (done - done_at_start) / (now - started))
+                    last_report = now
+                if status != 'running':
+                    break
+
+        async with session_pool() as session:
+            if status == 'running':
+                status = 'done'
+                await orm_set_campaign_status(session, campaign.id, status, from_status='running')
+            await orm_release_campaigns(session, self.owner, [campaign.id])
+            await session.commit()
+        campaign.status = status
+        done = campaign.sent + campaign.failed + campaign.blocked
+        await self._report(bot, campaign, done, 0, finished=True)
+        logger.info("Campaign %s %s: sent %s, blocked %s, failed %s", campaign.id,
+                    status, campaign.sent, campaign.blocked, campaign.failed)
+
+    def stats(self) -> dict:
+        return {"running": list(self._tasks), "owner": self.owner}
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,148 @@
+import logging
+from typing import Callable
+
+from aiohttp import web
+
+from app.database.instrumentation import Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+# Границы корзин гистограмм длительности в секундах
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+# Метрики бота в памяти процесса: счетчики и гистограммы пишутся из middleware
+# (app/middlewares/metrics.py), а stats() остальных компонентов (кэши, лимитер, SQL)
+# подключаются как gauges и снимаются только при запросе /metrics
+class Metrics:
+    def __init__(self):
+        self.updates: dict[str, int] = {}
+        self.errors: dict[tuple[str, str, str], int] = {}
+        self.update_duration = Histogram(DURATION_BUCKETS)
+        self.handler_duration: dict[tuple[str, str], Histogram] = {}
+        self.handler_db_time: dict[tuple[str, str], float] = {}
+        self.handler_api_time: dict[tuple[str, str], float] = {}
+        self.api_duration: dict[str, Histogram] = {}
+        self._gauges: dict[str, Callable[[], dict]] = {}
+
+    def observe_update(self, update_type: str, duration: float):
+        self.updates[update_type] = self.updates.get(update_type, 0) + 1
+        self.update_duration.observe(duration)
+
+    def observe_handler(self, router: str, handler: str, duration: float, db_time: float, api_time: float):
+        key = (router, handler)
+        histogram = self.handler_duration.get(key)
+        if histogram is None:
+            histogram = self.handler_duration[key] = Histogram(DURATION_BUCKETS)
+        histogram.observe(duration)
+        self.handler_db_time[key] = self.handler_db_time.get(key, 0.0) + db_time
+        self.handler_api_time[key] = self.handler_api_time.get(key, 0.0) + api_time
+
+    def observe_error(self, router: str, handler: str, error: BaseException):
+        key = (router, handler, type(error).__name__)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_api_call(self, method: str, duration: float):
+        histogram = self.api_duration.get(method)
+        if histogram is None:
+            histogram = self.api_duration[method] = Histogram(DURATION_BUCKETS)
+        histogram.observe(duration)
+
+    def add_gauges(self, name: str, stats: Callable[[], dict]):
+        self._gauges[name] = stats
+
+    @staticmethod
+    def _render_histogram(lines: list[str], name: str, histogram: Histogram, **labels):
+        cumulative = 0
+        for bound, bucket in zip(histogram.bounds, histogram.buckets):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.total}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+    # Текстовый формат Prometheus (exposition format 0.0.4)
+    def render(self) -> str:
+        lines = [
+            "# HELP bot_updates_total Processed updates by type",
+            "# TYPE bot_updates_total counter",
+        ]
+        lines += [f"bot_updates_total{_labels(type=update_type)} {count}" for update_type, count in self.updates.items()]
+
+        lines += ["# HELP bot_update_duration_seconds Full update processing time",
+                  "# TYPE bot_update_duration_seconds histogram"]
+        self._render_histogram(lines, "bot_update_duration_seconds", self.update_duration)
+
+        lines += ["# HELP bot_handler_duration_seconds Handler latency",
+                  "# TYPE bot_handler_duration_seconds histogram"]
+        for (router, handler), histogram in self.handler_duration.items():
+            self._render_histogram(lines, "bot_handler_duration_seconds", histogram, router=router, handler=handler)
+
+        lines += ["# HELP bot_handler_db_seconds_total Time spent in SQL queries by handler",
+                  "# TYPE bot_handler_db_seconds_total counter"]
+        lines += [f"bot_handler_db_seconds_total{_labels(router=router, handler=handler)} {value}"
+                  for (router, handler), value in self.handler_db_time.items()]
+
+        lines += ["# HELP bot_handler_api_seconds_total Time spent in Telegram API calls by handler",
+                  "# TYPE bot_handler_api_seconds_total counter"]
+        lines += [f"bot_handler_api_seconds_total{_labels(router=router, handler=handler)} {value}"
+                  for (router, handler), value in self.handler_api_time.items()]
+
+        lines += ["# HELP bot_handler_errors_total Handler exceptions",
+                  "# TYPE bot_handler_errors_total counter"]
+        lines += [f"bot_handler_errors_total{_labels(router=router, handler=handler, error=error)} {count}"
+                  for (router, handler, error), count in self.errors.items()]
+
+        lines += ["# HELP bot_telegram_api_duration_seconds Telegram API request time",
+                  "# TYPE bot_telegram_api_duration_seconds histogram"]
+        for method, histogram in self.api_duration.items():
+            self._render_histogram(lines, "bot_telegram_api_duration_seconds", histogram, method=method)
+
+        for name, stats in self._gauges.items():
+            for key, value in _flatten(stats(), name):
+                lines.append(f"# TYPE bot_{key} gauge")
+                lines.append(f"bot_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+# HTTP-сервер с /metrics. По умолчанию слушает только localhost
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Metrics are exposed on http://%s:%s/metrics", host, port)
+    return runner
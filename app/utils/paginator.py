@@ -2,17 +2,26 @@ import math
 
 
 # Простой пагинатор
+# Если передан total, пагинатор работает в режиме выборки из БД:
+# array содержит только строки текущей страницы (LIMIT/OFFSET), а total - общее количество
 class Paginator:
-    def __init__(self, array: list | tuple, page: int=1, per_page: int=1):
+    def __init__(self, array: list | tuple, page: int=1, per_page: int=1, total: int | None=None):
         self.array = array
         self.per_page = per_page
         self.page = page
-        self.len = len(self.array)
+        self.query_backed = total is not None
+        self.len = total if self.query_backed else len(self.array)
         # math.ceil - округление в большую сторону до целого числа
         self.pages = math.ceil(self.len / self.per_page)
 
+    @staticmethod
+    def get_offset(page: int, per_page: int=1):
+        return (page - 1) * per_page
+
     def __get_slice(self):
-        start = (self.page - 1) * self.per_page
+        if self.query_backed:
+            return self.array
+        start = self.get_offset(self.page, self.per_page)
         stop = start + self.per_page
         return self.array[start:stop]
 
@@ -31,13 +40,17 @@ class Paginator:
         return False
 
     def get_next(self):
+        if self.query_backed:
+            raise IndexError(f'Query-backed paginator holds only the current page. Fetch page {self.page + 1} from DB.')
         if self.page < self.pages:
             self.page += 1
             return self.get_page()
         raise IndexError(f'Next page does not exist. Use has_next() to check before.')
 
     def get_previous(self):
+        if self.query_backed:
+            raise IndexError(f'Query-backed paginator holds only the current page. Fetch page {self.page - 1} from DB.')
         if self.page > 1:
             self.page -= 1
             return self.__get_slice()
-        raise IndexError(f'Previous page does not exist. Use has_previous() to check before.')
\ No newline at end of file
+        raise IndexError(f'Previous page does not exist. Use has_previous() to check before.')
@@ -0,0 +1,104 @@
+import importlib
+import re
+from typing import Iterable
+
+from app.common import restricted_words as restricted_words_module
+
+
+# Латиница и цифры, которыми подменяют похожие кириллические буквы
+HOMOGLYPHS = {
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у",
+    "0": "о", "3": "з", "4": "ч", "6": "б", "@": "а", "ё": "е",
+}
+
+# Внутри слова между буквами допускаем только знаки без пробелов: "с.у.к.а", "с_у_к_а", "с*ка" -
+# иначе совпадение растягивается на соседние слова ("иди от меня" -> «идиот»)
+SEPARATOR = r"(?:[^\w\s]|_)*"
+# Слово, написанное вразрядку, ловим, только если каждая его часть - одна буква: "д у р а к", "с-у-к-а"
+SPACED_SEPARATOR = r"[\W_]+"
+
+
+# Матчер запрещенных слов: все слова собираются в одну скомпилированную регулярку,
+# которая проверяет текст за один проход без промежуточных строк.
+# Ловит подмену букв (homoglyphs), повторы ("сууука"), знаки между буквами и написание вразрядку
+class ProfanityMatcher:
+    def __init__(self, words: Iterable[str]):
+        self._table = str.maketrans(HOMOGLYPHS)
+        # Для каждой кириллической буквы - класс символов со всеми ее подменами: "а" -> "[а@a]"
+        variants: dict[str, set[str]] = {}
+        for fake, letter in HOMOGLYPHS.items():
+            variants.setdefault(letter, {letter}).add(fake)
+        self._letter_classes = {
+            letter: "[" + "".join(sorted(re.escape(char) for char in chars)) + "]"
+            for letter, chars in variants.items()
+        }
+        self._pattern = self._compile(words)
+
+    def _normalize_word(self, word: str) -> str:
+        word = word.lower().translate(self._table)
+        # Схлопываем повторы букв - повторы и так ловятся квантификатором "+"
+        return re.sub(r"(.)\1+", r"\1", word)
+
+    def _letter(self, letter: str) -> str:
+        return self._letter_classes.get(letter, re.escape(letter))
+
+    # Слова складываются в префиксное дерево, чтобы регулярка не перебирала
+    # все слова на каждой позиции текста, а шла по общим префиксам.
+    # spaced - вариант вразрядку: ровно одна буква между разделителями
+    def _trie_pattern(self, node: dict, spaced: bool = False) -> str:
+        separator = SPACED_SEPARATOR if spaced else SEPARATOR
+        alternatives = []
+        for letter, child in sorted(node.items()):
+            if letter == "":
+                continue
+            rest = self._trie_pattern(child, spaced)
+            current = self._letter(letter) + ("" if spaced else "+")
+            if not rest:
+                alternatives.append(current)
+            elif "" in child:
+                # Слово кончается на этой букве, но есть и более длинные: "бля" и "блять"
+                alternatives.append(current + "(?:" + separator + rest + ")?")
+            else:
+                alternatives.append(current + separator + rest)
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def _compile(self, words: Iterable[str]) -> re.Pattern:
+        trie: dict = {}
+        for word in words:
+            if not word.strip():
+                continue
+            node = trie
+            for letter in self._normalize_word(word.strip()):
+                node = node.setdefault(letter, {})
+            node[""] = {}
+
+        if not trie:
+            # Ничего не запрещено - регулярка, которая никогда не совпадает
+            return re.compile(r"(?!)")
+        pattern = "(?:" + self._trie_pattern(trie) + "|" + self._trie_pattern(trie, spaced=True) + ")"
+        return re.compile(r"(?<!\w)" + pattern + r"(?!\w)")
+
+    def search(self, text: str) -> str | None:
+        match = self._pattern.search(text.lower())
+        return match.group(0) if match else None
+
+    def __contains__(self, text: str) -> bool:
+        return self.search(text) is not None
+
+    # Регулярка подменяется одним присваиванием, поэтому параллельные проверки
+    # видят либо старый, либо новый список целиком
+    def load(self, words: Iterable[str]):
+        self._pattern = self._compile(words)
+
+    # Перечитывает app/common/restricted_words.py без перезапуска бота
+    def reload(self):
+        module = importlib.reload(restricted_words_module)
+        self.load(module.restricted_words)
+
+
+profanity_matcher = ProfanityMatcher(restricted_words_module.restricted_words)
@@ -0,0 +1,53 @@
+from typing import Callable
+
+
+# Настройки, которые админ меняет командой на лету (/sql_log, /reload_words).
+# В режиме воркеров (app/utils/workers.py) команда попадает только в один процесс, поэтому
+# значение и номер его изменения лежат в общей памяти пула. Процесс, получивший команду,
+# записывает их туда, а остальные сверяются перед каждым апдейтом и применяют изменения у себя.
+# Перезапущенный воркер применяет при подключении все изменения, сделанные до него
+class SharedSettings:
+    def __init__(self, names: tuple[str, ...]):
+        self.names = names
+        self._generations = None
+        self._values = None
+        self._seen = [0] * len(names)
+        self._appliers: dict[str, Callable[[int], None]] = {}
+
+    # Общие массивы создает пул в ingress и передает их воркерам
+    def allocate(self, context) -> tuple:
+        return context.Array("Q", len(self.names)), context.Array("q", len(self.names))
+
+    def attach(self, shared: tuple):
+        self._generations, self._values = shared
+        self._seen = [0] * len(self.names)
+        self.sync()
+
+    def on_change(self, name: str, apply: Callable[[int], None]):
+        self._appliers[name] = apply
+
+    def set(self, name: str, value: int = 0):
+        index = self.names.index(name)
+        if self._generations is not None:
+            with self._generations.get_lock():
+                self._values[index] = value
+                self._generations[index] += 1
+                self._seen[index] = self._generations[index]
+        self._apply(name, value)
+
+    def _apply(self, name: str, value: int):
+        apply = self._appliers.get(name)
+        if apply is not None:
+            apply(value)
+
+    def sync(self):
+        if self._generations is None:
+            return
+        for index, name in enumerate(self.names):
+            generation = self._generations[index]
+            if generation != self._seen[index]:
+                self._seen[index] = generation
+                self._apply(name, self._values[index])
+
+
+shared_settings = SharedSettings(("log_queries", "restricted_words"))
@@ -0,0 +1,28 @@
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+
+
+# Делит текст на части не длиннее лимита Telegram, разрезая только по границам строк
+# (HTML-теги в одной строке не разрываются). Строка длиннее лимита режется по символам
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    if len(text) <= limit:
+        return [text]
+
+    parts = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(line[:limit])
+            line = line[limit:]
+
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ''
+        current += line
+
+    if current:
+        parts.append(current)
+    return parts
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+
+# Очередь апдейтов вебхука: HTTP-хендлер только кладет апдейт в ограниченную очередь,
+# а разбирает ее фиксированное число воркеров. Если очередь заполнена, ответ Telegram'у
+# задерживается (back-pressure), а через put_timeout отдается 503 - Telegram повторит доставку позже
+class WebhookUpdateQueue:
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = 8,
+        queue_size: int = 1000,
+        put_timeout: float = 5.0,
+        secret_token: str | None = None,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.secret_token = secret_token
+        self.queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self.draining = False
+        self.rejected = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Новые апдейты больше не принимаем: 503, и Telegram повторит их доставку следующему процессу
+    def close(self):
+        self.draining = True
+
+    async def drain(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    # Дорабатываем то, что уже принято, и только потом останавливаем воркеры
+    async def stop(self):
+        self.close()
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                self.queue.task_done()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            return web.Response(status=401)
+        if self.draining:
+            return web.Response(status=503)
+
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning("Update queue is full (%s), update %s rejected", self.queue_size, update.update_id)
+            return web.Response(status=503)
+        return web.Response()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "rejected": self.rejected,
+            "draining": self.draining,
+        }
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    *,
+    base_url: str,
+    path: str = "/webhook",
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    workers: int = 8,
+    queue_size: int = 1000,
+    secret_token: str | None = None,
+    allowed_updates: list[str] | None = None,
+):
+    updates = WebhookUpdateQueue(
+        dispatcher,
+        bot,
+        workers=workers,
+        queue_size=queue_size,
+        secret_token=secret_token,
+    )
+
+    app = web.Application()
+    app.router.add_post(path, updates.handle)
+    runner = web.AppRunner(app)
+
+    # SIGTERM при деплое и Ctrl+C завершают сервер штатно, с дообработкой очереди
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+
+    workflow_data = {"dispatcher": dispatcher, "bots": [bot], "webhook_updates": updates, **dispatcher.workflow_data}
+    await dispatcher.emit_startup(bot=bot, **workflow_data)
+    await updates.start()
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        # Накопившиеся за время деплоя апдейты не сбрасываем - Telegram дошлет их на новый адрес
+        await bot.set_webhook(
+            url=base_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=allowed_updates,
+            drop_pending_updates=False,
+        )
+        logger.info("Webhook server is listening on %s:%s%s", host, port, path)
+        await stopping.wait()
+        logger.info("Shutting down webhook server, %s updates in queue", updates.stats()["queued"])
+    finally:
+        # Порядок важен: пока дорабатывается очередь, новые запросы получают 503; затем ждем
+        # уже начатые запросы (runner.cleanup), дорабатываем то, что они успели положить,
+        # и только после этого гасим воркеры
+        updates.close()
+        await updates.drain()
+        await runner.cleanup()
+        await updates.stop()
+        await dispatcher.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:  # pragma: no cover - Windows
+                pass
@@ -0,0 +1,272 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import signal
+from typing import Any, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+
+from app.database.cache import shared_invalidation
+from app.utils.shared_settings import shared_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Кольцо консистентного хеширования: каждый воркер занимает replicas точек на кольце,
+# чат обслуживает воркер с ближайшей точкой по часовой стрелке.
+# При изменении числа воркеров переезжает только ~1/N чатов
+class HashRing:
+    def __init__(self, nodes: int, replicas: int = 100):
+        ring = sorted((self._hash(f"{node}:{replica}"), node) for node in range(nodes) for replica in range(replicas))
+        self._points = [point for point, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def get(self, key: Any) -> int:
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+
+# Чат апдейта по сырому JSON: message.chat, callback_query.message.chat,
+# а для событий без чата (inline-запросы, колбэки inline-сообщений) - пользователь
+def update_chat_id(update: dict) -> int:
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return update["update_id"]
+
+
+######################### Воркер ###############################################
+
+# Апдейты одного чата выполняются строго по очереди (FSM, корзина),
+# разные чаты - параллельно, но не больше concurrency одновременно.
+# Разрешение на выполнение берется только после того, как доработал предыдущий апдейт чата -
+# иначе очередь одного занятого чата держала бы все разрешения и останавливала остальные.
+# Число принятых, но еще не выполненных апдейтов ограничено backlog (размер очереди воркера):
+# дальше воркер не читает очередь, и она давит на ingress
+async def _run_worker(
+    index: int, queue, generation, settings, setup: Callable[[], tuple[Dispatcher, Bot]], concurrency: int, backlog: int,
+):
+    dispatcher, bot = setup()
+    shared_invalidation.attach(generation)
+    shared_settings.attach(settings)
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    accepted = asyncio.Semaphore(backlog)
+    chat_tails: dict[int, asyncio.Task] = {}
+
+    async def process(update: dict, previous: asyncio.Task | None):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with semaphore:
+                await dispatcher.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception("Worker %s failed to process update %s", index, update.get("update_id"))
+        finally:
+            accepted.release()
+
+    def forget(chat_id: int, task: asyncio.Task):
+        if chat_tails.get(chat_id) is task:
+            del chat_tails[chat_id]
+
+    workflow_data = {"dispatcher": dispatcher, "bots": [bot], "worker": index, **dispatcher.workflow_data}
+    await dispatcher.emit_startup(bot=bot, **workflow_data)
+    logger.info("Worker %s started", index)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            chat_id, update = item
+            shared_invalidation.sync()
+            shared_settings.sync()
+
+            await accepted.acquire()
+            task = asyncio.create_task(process(update, chat_tails.get(chat_id)))
+            chat_tails[chat_id] = task
+            task.add_done_callback(lambda task, chat_id=chat_id: forget(chat_id, task))
+    finally:
+        if chat_tails:
+            await asyncio.wait(list(chat_tails.values()))
+        await dispatcher.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+        logger.info("Worker %s stopped", index)
+
+
+def _worker_main(index: int, queue, generation, settings, setup, concurrency: int, backlog: int):
+    # Ctrl+C и SIGTERM может получить вся группа процессов - останавливает воркеры только ingress,
+    # через очередь, после того как они доработают все, что им уже отдано
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_worker(index, queue, generation, settings, setup, concurrency, backlog))
+
+#########################################################################################
+
+
+######################### Ingress ###############################################
+
+# Пул воркер-процессов. setup - функция уровня модуля (передается в дочерний процесс по имени),
+# которая собирает Dispatcher и Bot внутри воркера. Состояние между процессами не делится:
+# FSM и данные лежат в БД, а кэши и настройки сверяются через общую память (shared_invalidation, shared_settings)
+class WorkerPool:
+    def __init__(
+        self,
+        setup: Callable[[], tuple[Dispatcher, Bot]],
+        workers: int,
+        concurrency: int = 64,
+        queue_size: int = 1000,
+    ):
+        self.setup = setup
+        self.workers = workers
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._generation = self._context.Value("Q", 0)
+        self._settings = shared_settings.allocate(self._context)
+        self._processes: list[multiprocessing.Process | None] = [None] * workers
+        self._ring = HashRing(workers)
+        self.dispatched = [0] * workers
+        self.restarts = 0
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                index, self._queues[index], self._generation, self._settings, self.setup, self.concurrency, self.queue_size,
+            ),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    # Упавший воркер поднимаем заново на ту же очередь - его чаты никуда не переезжают
+    def ensure_alive(self):
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.warning("Worker %s exited with code %s, restarting", index, process.exitcode)
+                self.restarts += 1
+                self._spawn(index)
+
+    # Заполненная очередь воркера блокирует только поток executor'а - это back-pressure для ingress
+    async def dispatch(self, update: dict):
+        chat_id = update_chat_id(update)
+        index = self._ring.get(chat_id)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._queues[index].put, (chat_id, update))
+        self.dispatched[index] += 1
+
+    # Маркер остановки встает в очередь после уже розданных апдейтов: воркер сначала
+    # дорабатывает их и только потом выходит. Зависший воркер через timeout убиваем
+    async def stop(self, timeout: float = 30):
+        loop = asyncio.get_running_loop()
+        for queue in self._queues:
+            await loop.run_in_executor(None, queue.put, None)
+        for process in self._processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, timeout)
+                if process.is_alive():
+                    process.terminate()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "dispatched": list(self.dispatched),
+            "queued": [queue.qsize() for queue in self._queues],
+            "restarts": self.restarts,
+        }
+
+
+# Ingress: long polling в одном процессе и раздача апдейтов воркерам по chat id.
+# Сам ingress апдейты не обрабатывает, поэтому ему нужен только Bot для getUpdates
+async def run_worker_pool(
+    bot: Bot,
+    setup: Callable[[], tuple[Dispatcher, Bot]],
+    *,
+    workers: int,
+    concurrency: int = 64,
+    queue_size: int = 1000,
+    polling_timeout: int = 30,
+    allowed_updates: list[str] | None = None,
+):
+    pool = WorkerPool(setup, workers, concurrency=concurrency, queue_size=queue_size)
+    pool.start()
+    logger.info("Started %s bot workers", workers)
+
+    # SIGTERM при деплое и Ctrl+C прерывают только ожидание getUpdates: уже полученные апдейты
+    # раздаются воркерам, а те дорабатывают свои очереди до конца
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+
+    offset = None
+    backoff = 1
+    try:
+        # Апдейты, пришедшие пока бот был выключен, не выбрасываем
+        await bot.delete_webhook(drop_pending_updates=False)
+        while not stopping.is_set():
+            fetch = asyncio.create_task(
+                bot(GetUpdates(offset=offset, timeout=polling_timeout, allowed_updates=allowed_updates))
+            )
+            stop_wait = asyncio.create_task(stopping.wait())
+            await asyncio.wait([fetch, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            if not fetch.done():
+                # Ответ прерванного запроса не подтвержден offset'ом - Telegram отдаст его следующему процессу
+                fetch.cancel()
+                await asyncio.gather(fetch, return_exceptions=True)
+                break
+            try:
+                updates = fetch.result()
+            except Exception:
+                logger.exception("Failed to fetch updates, retry in %s s", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+
+            pool.ensure_alive()
+            for update in updates:
+                await pool.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+    finally:
+        logger.info("Stopping bot workers")
+        await pool.stop()
+        # Подтверждаем Telegram'у offset обработанных апдейтов, иначе после рестарта они придут повторно
+        if offset is not None:
+            try:
+                await bot(GetUpdates(offset=offset, limit=1, timeout=0, allowed_updates=allowed_updates))
+            except Exception:
+                logger.exception("Failed to confirm update offset %s", offset)
+        await bot.session.close()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:  # pragma: no cover - Windows
+                pass
+
+#########################################################################################
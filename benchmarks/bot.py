@@ -0,0 +1,412 @@
+# Бенчмарк обработки апдейтов: настоящий Dispatcher из run.py (все middleware, роутеры, FSM в БД)
+# против локальной заглушки Telegram Bot API. Сценарии проигрываются от имени многих пользователей
+# параллельно, апдейты одного чата - строго по очереди, как их отдает Telegram.
+# На выходе по каждому сценарию - апдейтов/с, p50/p95/p99 латентности и запросов к БД на апдейт;
+# результат пишется в JSON (по умолчанию benchmarks/results/bot-<коммит>.json), --compare сравнивает с прошлым прогоном.
+#
+# Запуск: python -m benchmarks.bot [--users 200] [--concurrency 50] [--scenarios catalog,cart,checkout,spam]
+#                                  [--database-url URL] [--api-latency-ms 0] [--output PATH] [--compare PATH]
+#
+# По умолчанию база - временный файл SQLite. База из --database-url (например, локальный Postgres)
+# перед прогоном очищается! RateLimiter по умолчанию снят - меряем бота, а не лимиты Telegram
+# (--rate-limits включает). Checkout включает две паузы asyncio.sleep(1) из хендлеров заказа
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from aiohttp import web
+
+
+BOT_TOKEN = "123456:benchmark"
+BOT_ID = 123456
+CATEGORIES = ("Пицца", "Роллы", "Напитки", "Десерты")
+PRODUCTS_PER_CATEGORY = 20
+BAD_WORDS = ("сука", "идиот", "дебил")
+SPAM_WORDS = "привет кто закажет пиццу вечером доставка опять задерживается спасибо было вкусно".split()
+
+
+######################### Заглушка Bot API ###############################################
+
+# Отвечает на любой метод так, чтобы aiogram смог разобрать ответ: send*/edit* - сообщением,
+# sendMediaGroup - списком сообщений, остальное - true. Считает вызовы по методам
+class FakeBotAPI:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1000)
+
+    def _message(self, chat_id) -> dict:
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark"},
+        }
+
+    def _result(self, method: str, params) -> object:
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        if method == "getChatAdministrators":
+            return []
+        if method == "sendMediaGroup":
+            return [self._message(params["chat_id"]) for _ in json.loads(params["media"])]
+        if method.startswith(("send", "copy", "forward", "edit")) and "chat_id" in params:
+            return self._message(params["chat_id"])
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def start(self) -> tuple[web.AppRunner, str]:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host="127.0.0.1", port=0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        return runner, f"http://{host}:{port}"
+
+#########################################################################################
+
+
+######################### Сценарии ###############################################
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def message(self, user_id: int, text: str, chat_id: int | None = None) -> dict:
+        chat_id = chat_id or user_id
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "Benchmark"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark"},
+                },
+                "data": data,
+            },
+        }
+
+
+# Каждый сценарий возвращает поток апдейтов одного чата
+def catalog_stream(factory: UpdateFactory, rnd: random.Random, user_id: int, catalog: dict) -> list[dict]:
+    from app.keyboards.inline import MenuCallBack
+
+    updates = [factory.message(user_id, "/start")]
+    for _ in range(2):
+        category_id, name = rnd.choice(list(catalog))
+        updates.append(factory.callback(user_id, MenuCallBack(level=1, menu_name="catalog").pack()))
+        updates.append(factory.callback(user_id, MenuCallBack(level=2, menu_name=name, category=category_id).pack()))
+        for page in range(2, rnd.randint(3, 8)):
+            updates.append(factory.callback(
+                user_id, MenuCallBack(level=2, menu_name="next", category=category_id, page=page).pack()))
+    updates.append(factory.callback(user_id, MenuCallBack(level=0, menu_name="main").pack()))
+    return updates
+
+
+def cart_stream(factory: UpdateFactory, rnd: random.Random, user_id: int, catalog: dict) -> list[dict]:
+    from app.keyboards.inline import MenuCallBack
+
+    product_ids = rnd.sample([product_id for products in catalog.values() for product_id in products], 3)
+    updates = [factory.message(user_id, "/start")]
+    for product_id in product_ids:
+        updates.append(factory.callback(
+            user_id, MenuCallBack(level=2, menu_name="add_to_cart", product_id=product_id).pack()))
+    updates.append(factory.callback(user_id, MenuCallBack(level=3, menu_name="cart").pack()))
+    for page, product_id in enumerate(product_ids, start=1):
+        for menu_name in ("increment", "increment", "decrement"):
+            updates.append(factory.callback(
+                user_id, MenuCallBack(level=3, menu_name=menu_name, product_id=product_id, page=page).pack()))
+    updates.append(factory.callback(
+        user_id, MenuCallBack(level=3, menu_name="decrement", product_id=product_ids[-1], page=3).pack()))
+    return updates
+
+
+def checkout_stream(factory: UpdateFactory, rnd: random.Random, user_id: int, catalog: dict) -> list[dict]:
+    from app.keyboards.inline import MenuCallBack
+
+    product_ids = rnd.sample([product_id for products in catalog.values() for product_id in products], 2)
+    updates = [factory.message(user_id, "/start")]
+    for product_id in product_ids:
+        updates.append(factory.callback(
+            user_id, MenuCallBack(level=2, menu_name="add_to_cart", product_id=product_id).pack()))
+    updates.append(factory.callback(user_id, MenuCallBack(level=3, menu_name="cart").pack()))
+    updates.append(factory.callback(user_id, MenuCallBack(level=0, menu_name="order").pack()))
+    updates.append(factory.message(user_id, f"+7900{user_id % 10_000_000:07d}"))
+    updates.append(factory.message(user_id, f"ул. Тестовая, д. {rnd.randint(1, 200)}"))
+    updates.append(factory.callback(user_id, "confirm"))
+    return updates
+
+
+# Поток "пользователя" спама - это группа: в нее пишут разные участники, ~5% сообщений с матом
+def spam_stream(factory: UpdateFactory, rnd: random.Random, user_id: int, catalog: dict) -> list[dict]:
+    chat_id = -user_id
+    updates = []
+    for _ in range(20):
+        words = rnd.choices(SPAM_WORDS, k=rnd.randint(3, 15))
+        if rnd.random() < 0.05:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(BAD_WORDS))
+        updates.append(factory.message(user_id * 100 + rnd.randrange(20), " ".join(words), chat_id=chat_id))
+    return updates
+
+
+SCENARIOS = {
+    "catalog": catalog_stream,
+    "cart": cart_stream,
+    "checkout": checkout_stream,
+    "spam": spam_stream,
+}
+
+#########################################################################################
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def seed_catalog(session_maker) -> dict[tuple[int, str], list[int]]:
+    from app.database.models import Banner, Category, Product
+    from sqlalchemy import select, update
+
+    async with session_maker() as session:
+        await session.execute(update(Banner).values(image="benchmark-banner"))
+        categories = [Category(name=name) for name in CATEGORIES]
+        session.add_all(categories)
+        await session.flush()
+        session.add_all([
+            Product(name=f"{category.name} {number}", description="Описание товара для бенчмарка",
+                    price=round(5 + number * 0.75, 2), image=f"benchmark-product-{category.id}-{number}",
+                    category_id=category.id)
+            for category in categories
+            for number in range(1, PRODUCTS_PER_CATEGORY + 1)
+        ])
+        await session.commit()
+
+        rows = await session.execute(select(Product.id, Category.id, Category.name).join(Product.category))
+    catalog = {}
+    for product_id, category_id, name in rows:
+        catalog.setdefault((category_id, name), []).append(product_id)
+    return catalog
+
+
+async def run_scenario(name: str, streams: list[list[dict]], concurrency: int, api: FakeBotAPI) -> dict:
+    from aiogram.dispatcher.event.bases import UNHANDLED
+    from app.database.instrumentation import sql_instrumentation
+
+    import run
+
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    unhandled = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def replay(stream: list[dict]):
+        nonlocal unhandled
+        async with semaphore:
+            for update in stream:
+                started = time.perf_counter()
+                try:
+                    result = await run.dp.feed_raw_update(run.bot, update)
+                    if result is UNHANDLED:
+                        unhandled += 1
+                except Exception as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                latencies.append(time.perf_counter() - started)
+
+    sql_instrumentation.reset()
+    api_calls = api.total_calls()
+    started = time.perf_counter()
+    await asyncio.gather(*(replay(stream) for stream in streams))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    sql = sql_instrumentation.stats()
+    count = len(latencies)
+    return {
+        "updates": count,
+        "chats": len(streams),
+        "duration_s": round(elapsed, 3),
+        "updates_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "avg": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if count else 0.0,
+        },
+        "db_queries_per_update": {
+            "avg": round(sql["queries"] / count, 2) if count else 0.0,
+            "p95": sql["queries_per_update"]["p95"],
+            "max": sql["queries_per_update"]["max"],
+        },
+        "slow_queries": sql["slow_queries"],
+        "api_calls_per_update": round((api.total_calls() - api_calls) / count, 2) if count else 0.0,
+        "unhandled": unhandled,
+        "errors": errors,
+    }
+
+
+def git_revision() -> dict:
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def print_report(result: dict, baseline: dict | None):
+    print(f"{'scenario':<10} {'upd/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'sql/upd':>8} {'errors':>7}")
+    for name, stats in result["scenarios"].items():
+        latency = stats["latency_ms"]
+        print(f"{name:<10} {stats['updates_per_sec']:>9,.1f} {latency['p50']:>9.2f} {latency['p95']:>9.2f} "
+              f"{latency['p99']:>9.2f} {stats['db_queries_per_update']['avg']:>8.2f} {sum(stats['errors'].values()):>7}")
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old and old["updates_per_sec"]:
+            print(f"{'':<10} {stats['updates_per_sec'] / old['updates_per_sec'] - 1:>+9.1%} "
+                  f"{latency['p50'] - old['latency_ms']['p50']:>+9.2f} {latency['p95'] - old['latency_ms']['p95']:>+9.2f} "
+                  f"{latency['p99'] - old['latency_ms']['p99']:>+9.2f} "
+                  f"{stats['db_queries_per_update']['avg'] - old['db_queries_per_update']['avg']:>+8.2f}"
+                  f"   vs {str(baseline.get('commit'))[:10]}")
+
+
+async def benchmark(args) -> dict:
+    api = FakeBotAPI(latency=args.api_latency_ms / 1000)
+    runner, api_url = await api.start()
+
+    # run.py читает окружение при импорте - импортируем его, когда заглушка уже слушает
+    temp_dir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        temp_dir = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{temp_dir.name}/benchmark.sqlite3"
+    os.environ["BOT_API_URL"] = api_url
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+    os.environ["BOT_MODE"] = "polling"
+
+    import run
+    from app.database.engine import create_db, drop_db, engine
+
+    try:
+        if not args.rate_limits:
+            run.bot.session.middleware.unregister(run.rate_limiter)
+        if args.database_url:
+            await drop_db()
+        await create_db()
+        catalog = await seed_catalog(run.session_maker)
+
+        rnd = random.Random(args.seed)
+        factory = UpdateFactory()
+        user_ids = itertools.count(1_000_000)
+        scenarios = {}
+        for name in args.scenarios:
+            streams = [SCENARIOS[name](factory, rnd, next(user_ids), catalog) for _ in range(args.users)]
+            scenarios[name] = await run_scenario(name, streams, args.concurrency, api)
+    finally:
+        await run.bot.session.close()
+        await engine.dispose()
+        await runner.cleanup()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    return {
+        **git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "params": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "api_latency_ms": args.api_latency_ms,
+            "rate_limits": args.rate_limits,
+        },
+        "api_calls": api.calls,
+        "scenarios": scenarios,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Update-replay benchmark of the bot dispatcher")
+    parser.add_argument("--users", type=int, default=200, help="chats per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="chats replayed at the same time")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS))
+    parser.add_argument("--database-url", help="database to run against (it is dropped first!), default - temporary SQLite")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="simulated Bot API response time")
+    parser.add_argument("--rate-limits", action="store_true", help="keep RateLimiter on the bot session")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="result JSON path, default benchmarks/results/bot-<commit>.json")
+    parser.add_argument("--compare", help="previous result JSON to compare with")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    # Медленные запросы считаются в результате, построчный лог только мешает отчету
+    logging.basicConfig(level=logging.ERROR)
+    result = asyncio.run(benchmark(args))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(result, baseline)
+
+    output = Path(args.output or Path(__file__).parent / "results" / f"bot-{(result['commit'] or 'unknown')[:10]}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"saved to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Микробенчмарк фильтра мата: сравнивает старую проверку (maketrans + split + intersection)
+# с ProfanityMatcher на одном и том же наборе сообщений.
+# Запуск: python -m benchmarks.profanity [количество сообщений]
+import random
+import sys
+import time
+from string import punctuation
+
+from app.common.restricted_words import restricted_words
+from app.utils.profanity import ProfanityMatcher
+
+
+WORDS = (
+    "привет как дела закажу пиццу с ананасами вечером доставка курьер "
+    "спасибо очень вкусно когда будет заказ оплата картой адрес подъезд этаж"
+).split()
+
+OBFUSCATED = ["с.у.к.а", "сууука", "cyка", "д у р а к", "д е б и л", "6ля", "с_у_к_а"]
+
+# Чистый текст, похожий на запрещенные слова: соседние слова, слитные через пробел,
+# и части слов. Ни одно из них не должно совпасть
+CLEAN = [
+    "иди от меня подальше",
+    "ты дура к тому же",
+    "с ука",
+    "блииин",
+    "хлеб ля-ля",
+    "сук а",
+    "доставка 1 идет",
+    "дебет и лимит",
+    "с утра кашу",
+    "в 10 утра",
+]
+
+
+def legacy_clean_text(text: str):
+    return text.translate(str.maketrans("", "", punctuation))
+
+
+def legacy_check(text: str) -> bool:
+    return bool(restricted_words.intersection(legacy_clean_text(text.lower()).split()))
+
+
+def make_messages(count: int, seed: int = 42) -> list[str]:
+    rnd = random.Random(seed)
+    bad_words = sorted(restricted_words)
+    messages = []
+    for _ in range(count):
+        words = rnd.choices(WORDS, k=rnd.randint(3, 30))
+        roll = rnd.random()
+        if roll < 0.05:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(bad_words))
+        elif roll < 0.08:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(OBFUSCATED))
+        elif roll < 0.11:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(CLEAN))
+        messages.append(" ".join(words).capitalize() + rnd.choice([".", "!", "?", ""]))
+    return messages
+
+
+def run(name: str, check, messages: list[str]) -> float:
+    started = time.perf_counter()
+    matched = sum(1 for text in messages if check(text))
+    elapsed = time.perf_counter() - started
+    rate = len(messages) / elapsed
+    print(f"{name:<10} {rate:>12,.0f} msg/s  matched={matched}")
+    return rate
+
+
+# Скорость без точности ничего не стоит: обфусцированные слова должны находиться, а чистый текст - нет
+def check_accuracy(matcher: ProfanityMatcher) -> bool:
+    missed = [text for text in OBFUSCATED if not matcher.search(text)]
+    false_positives = [(text, matcher.search(text)) for text in CLEAN if matcher.search(text)]
+    print(f"obfuscated {len(OBFUSCATED) - len(missed)}/{len(OBFUSCATED)} matched  missed={missed}")
+    print(f"clean      {len(false_positives)}/{len(CLEAN)} false positives  {false_positives}")
+    return not missed and not false_positives
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    messages = make_messages(count)
+    matcher = ProfanityMatcher(restricted_words)
+
+    print(f"{count} messages")
+    legacy = run("legacy", legacy_check, messages)
+    compiled = run("compiled", matcher.search, messages)
+    print(f"speedup    {compiled / legacy:.2f}x")
+    return 0 if check_accuracy(matcher) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
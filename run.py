@@ -1,50 +1,187 @@
 import os, asyncio, logging
+from time import perf_counter
+
+# Отсчет холодного старта - до импорта aiogram, SQLAlchemy и модулей бота
+started_at = perf_counter()
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
-from app.middlewares.db import DataBaseSession
+from app.middlewares.db import DataBaseSession, SQLStatsMiddleware
+from app.middlewares.fsm import BufferedFSMContextMiddleware
+from app.middlewares.metrics import APITimingMiddleware, HandlerMetricsMiddleware, UpdateMetricsMiddleware
+from app.middlewares.rate_limit import RateLimiter, SendPriorityMiddleware
 
-from app.database.engine import create_db, drop_db, session_maker
+from app.database.cache import banner_cache, catalog_cache
+from app.database.engine import create_db, prime_caches, session_maker, warm_up_pool
+from app.database.fsm_storage import SQLAlchemyStorage
+from app.database.instrumentation import sql_instrumentation
 from app.handlers.user_group import user_group_router
 from app.handlers.user_private import user_private_router
 from app.handlers.admin_private import admin_private_router
+from app.keyboards.inline import keyboard_cache
+from app.utils.admins import admin_registry
+from app.utils.broadcast import broadcaster
+from app.utils.metrics import metrics, start_metrics_server
+from app.utils.webhook import run_webhook
+from app.utils.workers import run_worker_pool
+
+
+# BOT_API_URL позволяет направить бота на локальный Bot API сервер (или его заглушку в тестах)
+bot_api_url = os.getenv('BOT_API_URL')
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(bot_api_url)) if bot_api_url else None
+
+bot = Bot(token=os.getenv('BOT_TOKEN'), parse_mode=ParseMode.HTML, session=bot_session)
+
+# BOT_MODE=webhook - прием апдейтов через aiohttp сервер,
+# BOT_MODE=workers - long polling в ingress-процессе и обработка в BOT_WORKERS процессах, иначе long polling
+bot_mode = os.getenv('BOT_MODE', 'polling')
+bot_workers = int(os.getenv('BOT_WORKERS', os.cpu_count() or 1)) if bot_mode == 'workers' else 1
 
+# Все исходящие сообщения проходят через планировщик с лимитами Telegram.
+# Глобальный лимит общий для бота, поэтому делится между процессами-воркерами.
+# Ingress в режиме workers сообщений не отправляет (только getUpdates), его доля не расходуется
+rate_limiter = RateLimiter(global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', 30)) / bot_workers)
+bot.session.middleware(rate_limiter)
+bot.session.middleware(APITimingMiddleware(metrics))
 
-bot = Bot(token=os.getenv('BOT_TOKEN'), parse_mode=ParseMode.HTML)
-dp = Dispatcher()
+# FSM хранится в БД. Встроенный FSMContextMiddleware заменен своим: апдейты одного чата
+# обрабатываются по очереди, изменения FSM пишутся одним upsert'ом в конце апдейта,
+# а состояние читается только там, где есть хендлеры с фильтром по состоянию
+fsm_storage = SQLAlchemyStorage(session_maker)
+dp = Dispatcher(storage=fsm_storage, events_isolation=SimpleEventIsolation(), disable_fsm=True)
+dp.fsm = BufferedFSMContextMiddleware(storage=fsm_storage, events_isolation=dp.fsm.events_isolation, strategy=dp.fsm.strategy)
+dp.update.outer_middleware(SQLStatsMiddleware(sql_instrumentation))
+dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+dp.update.outer_middleware(dp.fsm)
 
-bot.my_admins_list = []
+# Пул сессий для фоновых задач, которые запускают хендлеры (рассылки)
+dp["session_pool"] = session_maker
 
 dp.include_router(user_group_router)
 dp.include_router(user_private_router)
 dp.include_router(admin_private_router)
+dp.fsm.collect(dp)
+
+db_middleware = DataBaseSession(session_pool=session_maker)
+dp.update.middleware(db_middleware)
+dp.message.middleware(SendPriorityMiddleware())
+dp.callback_query.middleware(SendPriorityMiddleware())
+
+# Метрики хендлеров и статистика компонентов для /metrics (METRICS_PORT)
+for observer in (dp.message, dp.edited_message, dp.callback_query):
+    observer.middleware(HandlerMetricsMiddleware(metrics, sql_instrumentation))
+metrics.add_gauges("sql", sql_instrumentation.stats)
+metrics.add_gauges("db", db_middleware.stats)
+metrics.add_gauges("fsm", fsm_storage.stats)
+metrics.add_gauges("fsm_context", dp.fsm.stats)
+metrics.add_gauges("rate_limiter", rate_limiter.stats)
+metrics.add_gauges("banner_cache", banner_cache.stats)
+metrics.add_gauges("catalog_cache", catalog_cache.stats)
+metrics.add_gauges("keyboard_cache", keyboard_cache.stats)
+metrics.add_gauges("admins", admin_registry.stats)
+metrics_runner = None
+
+# Время холодного старта процесса в секундах (лог и /metrics): импорты и сборка диспетчера,
+# проверка/миграция схемы (только в процессе, который выполняет on_startup) и готовность принимать апдейты
+startup_times = {"imports": perf_counter() - started_at}
+metrics.add_gauges("startup_seconds", lambda: startup_times)
 
 
 async def on_startup(bot):
-    
-    run_param = False
-    if run_param:
-        await drop_db()
-    
-    await create_db()    
+    schema_started = perf_counter()
+    await create_db()
+    startup_times["schema"] = perf_counter() - schema_started
+
+
+# Запускается в каждом процессе, который обрабатывает апдейты
+async def on_worker_startup(bot, worker: int = 0):
+    global metrics_runner
+    # ADMIN_CHATS - id групп через запятую, админы которых получают доступ к админке
+    admin_chats = [int(chat_id) for chat_id in os.getenv('ADMIN_CHATS', '').split(',') if chat_id.strip()]
+
+    # Независимые друг от друга соединения с БД, чтение админов и кэшей идут одновременно
+    await asyncio.gather(
+        warm_up_pool(),
+        admin_registry.start(bot, session_maker, chats=admin_chats, ttl=int(os.getenv('ADMIN_REFRESH_TTL', 600))),
+        prime_caches(),
+    )
+
+    # Рассылки, прерванные остановкой бота, продолжаются с сохраненного места. В режиме workers
+    # их ведут воркеры: кампанию захватывает по аренде один из них, а ingress закрывает
+    # свою сессию бота сразу после остановки пула
+    broadcaster.watch(bot, session_maker)
+
+    # Каждый воркер пула отдает метрики на своем порту: METRICS_PORT + номер воркера
+    if os.getenv('METRICS_PORT'):
+        metrics_runner = await start_metrics_server(
+            host=os.getenv('METRICS_HOST', '127.0.0.1'),
+            port=int(os.getenv('METRICS_PORT')) + worker,
+        )
+
+    startup_times["ready"] = perf_counter() - started_at
+    logging.info("Cold start: %.2f s (imports %.2f s, schema %s)", startup_times["ready"], startup_times["imports"],
+                 f"{startup_times['schema']:.2f} s" if "schema" in startup_times else "-")
 
 
 async def on_shutdown(bot):
+    await admin_registry.stop()
+    await broadcaster.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
     print('Бот остановлен')
 
 
+# Воркер пула (BOT_MODE=workers) импортирует этот модуль заново в своем процессе
+# и получает собственные bot и dp. Миграции (on_startup) выполняет только ingress
+def setup_worker():
+    dp.startup.register(on_worker_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp, bot
+
+
 async def main():
     dp.startup.register(on_startup)
+    dp.startup.register(on_worker_startup)
     dp.shutdown.register(on_shutdown)
     
-    dp.update.middleware(DataBaseSession(session_pool=session_maker))
-    
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    if bot_mode == 'webhook':
+        # Без публичного адреса Telegram некуда слать апдейты - не запускаемся вовсе
+        base_url = os.getenv('WEBHOOK_BASE_URL')
+        if not base_url:
+            raise SystemExit("BOT_MODE=webhook требует WEBHOOK_BASE_URL - публичный https-адрес бота")
+        await run_webhook(
+            dp,
+            bot,
+            base_url=base_url,
+            path=os.getenv('WEBHOOK_PATH', '/webhook'),
+            host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', 8080)),
+            workers=int(os.getenv('WEBHOOK_WORKERS', 8)),
+            queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)),
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    elif bot_mode == 'workers':
+        await on_startup(bot)
+        await run_worker_pool(
+            bot,
+            setup_worker,
+            workers=bot_workers,
+            concurrency=int(os.getenv('BOT_WORKER_CONCURRENCY', 64)),
+            queue_size=int(os.getenv('BOT_WORKER_QUEUE_SIZE', 1000)),
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    else:
+        # Апдейты, пришедшие пока бот был выключен (например, во время деплоя), не выбрасываем
+        await bot.delete_webhook(drop_pending_updates=False)
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)